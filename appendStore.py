@@ -0,0 +1,72 @@
+import os
+
+
+'''Plumbing shared by the append only stores (projectionStore, descriptionStore)
+
+    A store is a set of files next to a base path, written frame by frame. Data files are appended first and the
+    index file that points into them last, a store cut short by a crash stays readable up to the last complete frame.
+    Resuming truncates every file to the sizes of the frames to keep and continues appending after them.
+'''
+
+
+def basePath(path, extensions):
+
+    ''' strips any of the store extensions, accepts either the base path or any of the store files '''
+
+    for ext in extensions:
+        if path.endswith(ext): return path[:-len(ext)]
+
+    return path
+
+def isStore(path, extensions, marker):
+
+    ''' returns True if the marker file of the store at path exists '''
+
+    return path is not None and os.path.exists(basePath(path, extensions) + marker)
+
+def checkResume(path, resumeFrames, exists, kind):
+
+    ''' resumeFrames to reopen the store with, None starts a fresh one. Frame 0 on a missing store simply starts over,
+        later frames cannot be resumed without the store '''
+
+    if resumeFrames is not None and not exists:
+        if resumeFrames > 0:
+            raise FileNotFoundError(f'{path} {kind} store is missing, cannot resume at frame {resumeFrames}')
+        return None
+
+    return resumeFrames
+
+
+class appendWriter():
+
+    ''' base of the store writers, owns the open store files in append order (data first, index last) '''
+
+    def openFiles(self, extensions, sizes=None):
+
+        ''' open path + each extension, fresh or (with sizes) truncated to the byte size of the frames kept and
+            positioned at its end, returns the files in the order given '''
+
+        if sizes is None:
+            self.files = [open(self.path + ext, 'wb') for ext in extensions]
+            return self.files
+
+        self.files = [open(self.path + ext, 'r+b') for ext in extensions]
+        for file, size in zip(self.files, sizes):
+            file.truncate(size)
+            file.seek(size)
+
+        return self.files
+
+    def flush(self):
+
+        ''' force written frames to disk '''
+
+        for file in self.files:
+            file.flush()
+            os.fsync(file.fileno())
+
+    def close(self):
+
+        self.flush()
+        for file in self.files:
+            file.close()
@@ -0,0 +1,173 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import buildDataSet5
+import projectionStore
+import renderManifest
+
+
+'''Build every dataset under a root folder with buildDataSet5, in parallel
+
+    Datasets are found by the layout spawnDirs.spawnDirStruct creates:
+
+                root/
+                    |   subjectDir/
+                            |   fileName/
+                                    |   csvFile/<fileName>.csv
+                                    |   csvFile/<fileName>_gcp.csv  (written by the build)
+                                    |   jsonFile/
+                                    |   projectionMat/
+                                    |   renders/
+
+    A dataset is skipped when every output (jsonl, <fileName>_gcp.csv) exists and is newer than every input (csv,
+    projection data, render manifest). buildDataSet5 never modifies its inputs, rebuilding a dataset gives the same outputs.
+'''
+
+
+def discoverDataSets(root):
+
+    ''' returns list of dataset dirs (with trailing '/') under root that follow the spawnDirs layout '''
+
+    dataSets = []
+
+    for dirPath, dirNames, _ in os.walk(root):
+        if 'csvFile' in dirNames and 'renders' in dirNames:
+            fileName = os.path.basename(dirPath)
+            if os.path.exists(os.path.join(dirPath, 'csvFile', fileName + '.csv')):
+                dataSets.append(dirPath.rstrip('/') + '/')
+            dirNames[:] = []    #do not descend into a dataset
+
+    return sorted(dataSets)
+
+def dataSetArgs(dataSetDir, root, gcpRoot, split):
+
+    ''' buildDataSet5.main keyword arguments for one dataset, gcp path mirrors the path relative to root '''
+
+    fileName = os.path.basename(dataSetDir.rstrip('/'))
+
+    #prefer the fixed width projection store, fall back to .npy, None if bboxes were streamed into the csv
+    projectionBase = dataSetDir + 'projectionMat/' + fileName
+    if projectionStore.isStore(projectionBase): vertexPath = projectionBase
+    elif os.path.exists(projectionBase + '.npy'): vertexPath = projectionBase + '.npy'
+    else: vertexPath = None
+
+    relative = os.path.relpath(dataSetDir, root).replace(os.sep, '/')
+
+    return dict(fileName=       fileName,
+                renderCount=    None,
+                rootDir=        dataSetDir,
+                renderPath=     dataSetDir + 'renders/',
+                vertexPath=     vertexPath,
+                csvPath=        dataSetDir + 'csvFile/' + fileName + '.csv',
+                gcpCsvPath=     dataSetDir + 'csvFile/' + fileName + '_gcp.csv',
+                jsonPath=       dataSetDir + 'jsonFile/',
+                gcpPath=        gcpRoot + relative + '/',
+                split=          split)
+
+def inputPaths(args):
+
+    ''' files a build reads '''
+
+    paths = [args['csvPath'], renderManifest.manifestPath(args['renderPath'], args['fileName'])]
+
+    vertexPath = args['vertexPath']
+    if vertexPath is not None and projectionStore.isStore(vertexPath):
+        base = projectionStore.basePath(vertexPath)
+        paths += [base + '.proj.json', base + '.xy.bin', base + '.depth.bin', base + '.offsets.bin']
+    elif vertexPath is not None:
+        paths.append(vertexPath)
+
+    return [path for path in paths if os.path.exists(path)]
+
+def outputPaths(args, compressJsonl=False):
+
+    ''' files a build writes '''
+
+    return [args['jsonPath'] + args['fileName'] + '.jsonl' + ('.gz' if compressJsonl else ''), args['gcpCsvPath']]
+
+def isUpToDate(args, compressJsonl=False):
+
+    ''' True if every output exists and is newer than every input '''
+
+    outputs = outputPaths(args, compressJsonl)
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+
+    oldest = min(os.path.getmtime(path) for path in outputs)
+    return all(os.path.getmtime(path) <= oldest for path in inputPaths(args))
+
+def buildOne(args, options):
+
+    ''' worker: build a single dataset, returns (fileName, error or None, seconds) '''
+
+    startTime = time.time()
+
+    try:
+        buildDataSet5.main(**args, **options)
+        error = None
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+
+    return args['fileName'], error, time.time() - startTime
+
+def main(root, gcpRoot, split, workers=4, force=False, options=None):
+
+    ''' build every dataset under root
+
+        PARAMS:
+            root:       folder searched for datasets
+            gcpRoot:    gcs prefix, each dataset gets gcpRoot + <path relative to root> + '/'
+            split:      [train, test, validation] passed to every build
+            workers:    <int>   process pool size
+            force:      <bool>  rebuild datasets whose outputs are already up to date (safe, builds only write outputs)
+            options:    <dict>  extra buildDataSet5.main keyword arguments (engine, compressJsonl, ...)
+
+        Returns list of (fileName, status, seconds, error) '''
+
+    if options is None: options = dict()
+    compressJsonl = options.get('compressJsonl', False)
+
+    jobs = []
+    results = []
+
+    for dataSetDir in discoverDataSets(root):
+        args = dataSetArgs(dataSetDir, root, gcpRoot, split)
+        if not force and isUpToDate(args, compressJsonl):
+            results.append((args['fileName'], 'skipped', 0., None))
+        else:
+            jobs.append(args)
+
+    print(f'found {len(jobs) + len(results)} datasets, building {len(jobs)} with {workers} workers')
+
+    startTime = time.time()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(buildOne, args, options) for args in jobs]
+
+        for future in futures:
+            fileName, error, seconds = future.result()
+            status = 'failed' if error else 'built'
+            results.append((fileName, status, seconds, error))
+            print(f'{status:>8}  {fileName:<30} {seconds:8.1f}s  {error or ""}')
+
+    failed = [result for result in results if result[1] == 'failed']
+    print(f'batch done in {time.time() - startTime:.1f}s, {len(failed)} failed')
+
+    return results
+
+
+if __name__ == "__main__":
+
+    root = "/media/tuna/Pauls_USBA/"
+    gcpRoot = "gs://metapix-advmfg-bucket-d/mtdc_fvis_synthetic/training_datasets/"
+
+    #data splits
+    split = [0.80, 0.0, 0.2] #[Train, test, validation] ***sum(split) = 1***
+
+    main(root =         root,
+         gcpRoot =      gcpRoot,
+         split =        split,
+         workers =      4,
+         force =        False,
+         options =      dict({'engine': 'numpy'}))
@@ -7,12 +7,27 @@ import time
 import random
 import bmesh
 import mathutils
-
-def convertVertices(scene, cam, obj, resolutionX, resolutionY):
+from mathutils.bvhtree import BVHTree
+import json
+import os
+import hashlib
+import queue
+import atexit
+import threading
+import shutil
+import tempfile
+
+def convertVertices(scene, cam, obj, resolutionX, resolutionY, batched=False):
     
     ''' returns a list of object vertex coordinates projected onto image plane
-        output = [[x, y, depthToCamera]] '''
+        output = [[x, y, depthToCamera]]
+
+        batched:    if True, projection is done on the whole mesh at once with numpy (see projectVertices)
+                    and an (N, 3) array is returned instead of a list '''
     
+    if batched:
+        return projectVertices(scene, cam, obj, resolutionX, resolutionY)
+
     projectedVertices = []
 
     for vertex in obj.data.vertices:
@@ -25,6 +40,325 @@ def convertVertices(scene, cam, obj, resolutionX, resolutionY):
 
     return projectedVertices
 
+def getVertexArray(mesh):
+
+    ''' returns (N, 3) numpy array of local vertex coordinates, pulled in a single foreach_get call '''
+
+    coords = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get('co', coords)
+
+    return coords.reshape(-1, 3)
+
+def projectVertices(scene, cam, obj, resolutionX, resolutionY, localCoords=None):
+
+    ''' vectorized version of convertVertices, projects the whole mesh onto the image plane in one matrix multiply
+
+        PARAMS:
+            localCoords:    optional (N, 3) array of object local coordinates to project instead of obj.data.vertices
+
+        Returns (N, 3) float64 array of [pixelX, pixelY, depthToCamera], matches convertVertices output within truncation
+        (same y flip, resolution scaling, int truncation and depth rounding, but pixels stay floats, cast with .astype(int)).
+        A vertex projecting right onto a pixel boundary can land one pixel off the per vertex path '''
+
+    if localCoords is None:
+        localCoords = getVertexArray(obj.data)
+
+    localCoords = np.asarray(localCoords, dtype=np.float64).reshape(-1, 3)
+
+    #object -> world -> camera frame, same normalized camera matrix used by world_to_camera_view
+    world2Cam = np.array(cam.matrix_world.normalized().inverted()) @ np.array(obj.matrix_world)
+    camCoords = localCoords @ world2Cam[:3, :3].T + world2Cam[:3, 3]
+
+    z = -camCoords[:, 2]
+
+    #camera frame corners, [0] top right, [1] bottom right, [2] bottom left
+    frame = [v for v in cam.data.view_frame(scene=scene)[:3]]
+    minX, maxX = frame[2].x, frame[1].x
+    minY, maxY = frame[1].y, frame[0].y
+
+    x = camCoords[:, 0]
+    y = camCoords[:, 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        if cam.data.type != 'ORTHO':
+            #perspective divide, world_to_camera_view scales the frame by z / -frame.z instead of scaling the point
+            scale = -frame[0].z / z
+            x = x * scale
+            y = y * scale
+
+        x = (x - minX) / (maxX - minX)
+        y = (y - minY) / (maxY - minY)
+
+    #world_to_camera_view returns image center for points on the camera plane
+    if cam.data.type != 'ORTHO':
+        onPlane = z == 0.0
+        x[onPlane] = 0.5
+        y[onPlane] = 0.5
+
+    projectedVertices = np.empty((len(localCoords), 3), dtype=np.float64)
+    projectedVertices[:, 0] = np.trunc(resolutionX*x)
+    projectedVertices[:, 1] = np.trunc(resolutionY - resolutionY*y)
+    projectedVertices[:, 2] = np.round(z, 3)
+
+    return projectedVertices
+
+def projectionBounds(projectedVertices):
+
+    ''' reduce projected vertices to a 2D bbox and depth range, same int truncation buildDataSet5 uses
+        output = [xMin, xMax, yMin, yMax, depthMin, depthMax] '''
+
+    vertices = np.asarray(projectedVertices, dtype=np.float64).reshape(-1, 3)
+    pixels = np.trunc(vertices[:, :2])
+
+    xMin, yMin = pixels.min(axis=0)
+    xMax, yMax = pixels.max(axis=0)
+
+    return [int(xMin), int(xMax), int(yMin), int(yMax), float(vertices[:, 2].min()), float(vertices[:, 2].max())]
+
+def meshKey(mesh, full=True):
+
+    ''' returns a hashable key identifying the current state of a mesh datablock, used to invalidate caches
+
+        full:   also hash the vertex coordinates (one foreach_get), catches edits that do not change the topology,
+                eg. random deformations between frames. False keys on identity and element counts only '''
+
+    key = (mesh.as_pointer(), len(mesh.vertices), len(mesh.edges), len(mesh.polygons))
+
+    if full:
+        key += (hash(getVertexArray(mesh).tobytes()),)
+
+    return key
+
+class projectionProxies():
+
+    ''' per object cache of the local space points used for bbox projection. Only the silhouette extremes matter
+        for an axis aligned bbox, so projecting the convex hull (or the 8 bound_box corners) gives the same box as
+        projecting every vertex. Hulls are computed once and reused every frame, a lookup only compares the mesh
+        datablock and its element counts (no per vertex work). Code that moves vertices of a mesh in place without
+        changing its topology calls invalidate(obj) afterwards.
+
+        PARAMS:
+            method:     <'hull', 'boundBox'>    'boundBox' is faster but gives a looser box for non box shaped parts,
+                                                bound_box is kept up to date by blender and read on every lookup '''
+
+    def __init__(self, method='hull'):
+
+        self.method = method
+        self.proxies = dict()   #objName: {'key': meshKey, 'points': (N, 3) array}
+
+    def points(self, obj):
+
+        ''' returns (N, 3) array of local space proxy points for obj, rebuilding if mesh changed '''
+
+        if self.method == 'boundBox':
+            return self.build(obj)
+
+        key = meshKey(obj.data, full=False)
+
+        proxy = self.proxies.get(obj.name)
+        if proxy is None or proxy['key'] != key:
+            proxy = {'key': key, 'points': self.build(obj)}
+            self.proxies[obj.name] = proxy
+
+        return proxy['points']
+
+    def build(self, obj):
+
+        ''' compute proxy points for obj using the cache method '''
+
+        if self.method == 'boundBox':
+            return np.array([corner[:] for corner in obj.bound_box], dtype=np.float64)
+
+        bm = bmesh.new()
+        bm.from_mesh(obj.data)
+
+        try:
+            result = bmesh.ops.convex_hull(bm, input=bm.verts[:], use_existing_faces=False)
+            hull = [ele.co[:] for ele in result['geom'] if isinstance(ele, bmesh.types.BMVert)]
+        except Exception:
+            hull = []
+
+        bm.free()
+
+        #flat or degenerate meshes have no 3D hull, all vertices are needed
+        if len(hull) < 4:
+            return getVertexArray(obj.data).astype(np.float64)
+
+        return np.array(hull, dtype=np.float64)
+
+    def invalidate(self, obj=None):
+
+        ''' drop cached proxy for obj, or every proxy if obj is None '''
+
+        if obj is None: self.proxies.clear()
+        else: self.proxies.pop(obj.name, None)
+
+def curveKey(curve):
+
+    ''' returns a hashable key identifying the current state of a curve datablock, control points, handles and resolution '''
+
+    key = (curve.as_pointer(), curve.resolution_u)
+
+    for spline in curve.splines:
+        if spline.type == 'BEZIER':
+            points, fields, width = spline.bezier_points, ['co', 'handle_left', 'handle_right'], 3
+        else:
+            points, fields, width = spline.points, ['co'], 4
+
+        for field in fields:
+            coords = np.empty(len(points) * width, dtype=np.float32)
+            points.foreach_get(field, coords)
+            key += (spline.resolution_u, hash(coords.tobytes()))
+
+    return key
+
+def weldIndices(vertices, tolerance=1e-6):
+
+    ''' returns (N,) index of each vertex into the unique positions, vertices closer than tolerance * AABB diagonal
+        (snapped to that grid) share an index '''
+
+    if len(vertices) == 0: return np.zeros(0, dtype=np.int64)
+
+    step = max(tolerance * np.linalg.norm(vertices.max(axis=0) - vertices.min(axis=0)), 1e-12)
+    _, welded = np.unique(np.round(vertices / step).astype(np.int64), axis=0, return_inverse=True)
+
+    return welded.reshape(-1)
+
+def isClosed(vertices, triangles):
+
+    ''' True if every triangle side is shared by an even number of triangles once coincident vertices are welded '''
+
+    welded = weldIndices(vertices)[triangles]
+    sides = np.sort(welded[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    sides = sides[sides[:, 0] != sides[:, 1]]     #sides collapsed by the weld
+
+    return bool((np.unique(sides, axis=0, return_counts=True)[1] % 2 == 0).all())
+
+#curve data settings that turn a spline into a surface, and their values for the bare spline
+CURVE_SHAPE = {'bevel_depth': 0., 'extrude': 0., 'bevel_object': None}
+
+class constraintGeometry():
+
+    ''' per object cache of the world space geometry of constraint objects (curves, planes, volumes). The evaluated
+        mesh is pulled once with to_mesh (no bpy.ops convert/delete round trip) and kept with everything the limit and
+        sampling helpers need, until the matrix or the data of the object changes.
+
+        entry:
+            vertices:   (N, 3) world space vertices, in mesh order (curves: along the spline, without bevel or extrude)
+            edges:      (K, 2) vertex indices of the mesh edges
+            arcLengths: (K + 1,) cumulative world space edge length, arcLengths[k] = length of edges [0, k)
+            triangles:  (M, 3) vertex indices of the loop triangles, empty for curves without faces
+            areas:      (M,)   world space triangle areas
+            areaTable:  (M + 1,) cumulative triangle area, areaTable[m] = area of triangles [0, m)
+            closed:     <bool> every triangle side is shared by an even number of triangles after welding coincident
+                               vertices, the mesh encloses a volume
+            low, high:  (3,)   world space AABB corners
+            bvh:        BVHTree of the triangles, None without faces
+
+        PARAMS:
+            validate:   <bool>  hash vertex coordinates of meshes on every lookup to catch in place edits '''
+
+    def __init__(self, validate=True):
+
+        self.validate = validate
+        self.entries = dict()   #objName: {'key': (matrix hash, data key), vertices, triangles, ...}
+
+    def key(self, obj):
+
+        matrix = hash(np.array(obj.matrix_world, dtype=np.float64).tobytes())
+
+        if obj.type == 'CURVE': return (matrix, curveKey(obj.data))
+        return (matrix, meshKey(obj.data, full=self.validate))
+
+    def get(self, obj):
+
+        ''' returns the geometry entry of obj (object or object name), rebuilding if the object changed '''
+
+        if isinstance(obj, str): obj = bpy.data.objects[obj]
+
+        key = self.key(obj)
+
+        entry = self.entries.get(obj.name)
+        if entry is None or entry['key'] != key:
+            entry = self.build(obj)
+            entry['key'] = key
+            self.entries[obj.name] = entry
+
+        return entry
+
+    def build(self, obj):
+
+        ''' pull the evaluated mesh of obj into world space arrays '''
+
+        #a beveled or extruded curve evaluates to a tube or ribbon, its vertices and edges are pulled from the bare
+        # spline instead (bevel and extrude off while evaluating, restored right after)
+        if obj.type == 'CURVE': shape = {name: getattr(obj.data, name) for name in CURVE_SHAPE if hasattr(obj.data, name)}
+        else: shape = dict()
+
+        try:
+            for name in shape: setattr(obj.data, name, CURVE_SHAPE[name])
+
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            evaluated = obj.evaluated_get(depsgraph)
+            mesh = evaluated.to_mesh()
+
+            mesh.calc_loop_triangles()
+            triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+            mesh.loop_triangles.foreach_get('vertices', triangles)
+            triangles = triangles.reshape(-1, 3)
+
+            edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+            mesh.edges.foreach_get('vertices', edges)
+            edges = edges.reshape(-1, 2)
+
+            matrix = np.array(obj.matrix_world, dtype=np.float64)
+            vertices = getVertexArray(mesh).astype(np.float64) @ matrix[:3, :3].T + matrix[:3, 3]
+
+            evaluated.to_mesh_clear()
+
+        finally:
+            for name, value in shape.items(): setattr(obj.data, name, value)
+
+        arcLengths = np.concatenate([[0.], np.cumsum(np.linalg.norm(vertices[edges[:, 1]] - vertices[edges[:, 0]], axis=1))])
+
+        corners = vertices[triangles]
+        areas = np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1) / 2
+
+        #open or flat meshes (planes, sheets) are sampled on their surface, closed ones inside their volume. Sides are
+        # compared on welded positions, split normals, uv seams or an edge split modifier duplicate vertices of a
+        # watertight mesh without opening it
+        closed = len(triangles) > 0 and isClosed(vertices, triangles)
+
+        bvh = BVHTree.FromPolygons(vertices.tolist(), triangles.tolist()) if len(triangles) else None
+
+        return {'vertices':     vertices,
+                'edges':        edges,
+                'arcLengths':   arcLengths,
+                'triangles':    triangles,
+                'areas':        areas,
+                'areaTable':    np.concatenate([[0.], np.cumsum(areas)]),
+                'closed':       closed,
+                'low':          vertices.min(axis=0),
+                'high':         vertices.max(axis=0),
+                'bvh':          bvh}
+
+    def invalidate(self, obj=None):
+
+        ''' drop cached geometry for obj, or every entry if obj is None '''
+
+        if obj is None: self.entries.clear()
+        else: self.entries.pop(obj if isinstance(obj, str) else obj.name, None)
+
+#shared by generatePositions and the constraint limit helpers
+CONSTRAINT_CACHE = constraintGeometry()
+
+def worldVectors(obj):
+
+    ''' returns list of world space vertex Vectors of a constraint object, from the constraint cache '''
+
+    return [mathutils.Vector(vertex) for vertex in CONSTRAINT_CACHE.get(obj)['vertices']]
+
 def updatePosition(obj, trajectory, timeStep):
 
     ''' adds velocity to position '''
@@ -86,23 +420,13 @@ def cart2Sphere(cart):
 def getCartesianBounds(obj):
 
     '''returns cartesian bounding cube constraint coordinates from argument object
-        Assumes bounding rectangular prizm
+        world space AABB of the object, from the constraint cache
         struct: [[minX, maxX], [minY, maxY], [minZ, maxZ]]
         '''
-    #bounding_box = [obj.matrix_world]# @ vertex.co for vertex in obj.bound_box]
-
-    bounding_box = []
-    #solve for world coordinates of cube vertices
-    for vertex in obj.data.vertices:
-        worldCoords = obj.matrix_world @ vertex.co
-        bounding_box.append(worldCoords)
 
-    #extract x, y, z
-    xMin, xMax = bounding_box[0][0], bounding_box[7][0]
-    yMin, yMax = bounding_box[0][1], bounding_box[7][1]
-    zMin, zMax = bounding_box[0][2], bounding_box[7][2]
+    entry = CONSTRAINT_CACHE.get(obj)
 
-    return [[xMin, xMax],[yMin, yMax], [zMin, zMax]]
+    return [[float(low), float(high)] for low, high in zip(entry['low'], entry['high'])]
 
 
 def getRandomCarts(outerConstraint, innerConstraint=None, randomType='Uniform', NormalCenter = 'center', sigma = None):
@@ -185,38 +509,18 @@ def rcmUpdate(obj, tLimits, rLimits, initLoc, initRot):
 
 def curveLimits(obj):
 
-    '''Take a curve object, convert to mesh and return limit verticies converted to world frame'''
+    '''Take a curve object, return the end vertices of its evaluated mesh in world frame'''
 
-    limits = []
+    vertices = CONSTRAINT_CACHE.get(obj)['vertices']
 
-    bpy.ops.object.convert(target='MESH', keep_original=True, merge_customdata=True, angle=1.22173, thickness=5, seams=False, faces=True, offset=0.01)
-
-    meshCurve = bpy.context.selected_objects[0]
-
-    curveCoords = [meshCurve.data.vertices[0].co, meshCurve.data.vertices[-1].co]
-    curveWorldMat = meshCurve.matrix_world
-
-    limits.append(curveWorldMat @ curveCoords[0])
-    limits.append(curveWorldMat @ curveCoords[1])
-
-    bpy.ops.object.select_all(action='DESELECT')
-    meshCurve.select_set(True)
-    bpy.ops.object.delete()
-
-    return limits
+    return [mathutils.Vector(vertices[0]), mathutils.Vector(vertices[-1])]
 
 
 def planarLimits(obj):
 
     '''Take a planar object, return a list of vertices at limit of object converted to world coordinates'''
 
-    limits = []
-
-    for vert in obj.data.vertices:
-        coord = vert.co
-        limits.append(obj.matrix_world @ coord)
-
-    return limits
+    return worldVectors(obj)
     
 def volumeLimits(obj):
 
@@ -224,13 +528,7 @@ def volumeLimits(obj):
 
     ### Redundant placeholder ###
 
-    limits = []
-
-    for vert in obj.data.vertices:
-        coord = vert.co
-        limits.append(obj.matrix_world @ coord)
-
-    return limits
+    return worldVectors(obj)
 
 
 
@@ -242,47 +540,18 @@ def callBack():
 
 def constraintLimits(constraint):
 
-    limits = []
-    
-    file = open('/home/tuna/Documents/driving/Vision/syntheticData/bpyTest.txt', 'w')
-    file.write('in func\n')
-    file.write(f'constraint:{constraint} \n')
-    file.write(f'constraint:{constraint.type} \n')
-    file.write('and1 \n')
+    '''limit vertices of a curve, planar or volume constraint in world frame'''
 
     if constraint.type == 'CURVE':
-        file.write('found a curve')
-        bpy.ops.object.convert(target='MESH', keep_original=True, merge_customdata=True, angle=1.22173, thickness=5, seams=False, faces=True, offset=0.01)
-
-        meshCurve = bpy.context.selected_objects[0]
-
-        curveCoords = [meshCurve.data.vertices[0].co, meshCurve.data.vertices[-1].co]
-        curveWorldMat = meshCurve.matrix_world
-
-        limits.append(curveWorldMat @ curveCoords[0])
-        limits.append(curveWorldMat @ curveCoords[1])
-
-        bpy.ops.object.select_all(action='DESELECT')
-        meshCurve.select_set(True)
-        bpy.ops.object.delete()
+        return curveLimits(constraint)
 
     #planar object mesh
     elif (constraint.type == 'MESH') and (len(constraint.data.vertices) == 4):
-        file.write('found a mesh plane')
-        for vert in constraint.data.vertices:
-            coord = vert.co
-            limits.append(constraint.matrix_world @ coord)
+        return planarLimits(constraint)
 
     #Volume object mesh
     else:
-        file.write('found a mesh vol')
-        for vert in constraint.data.vertices:
-            coord = vert.co
-            limits.append(constraint.matrix_world @ coord)
-
-    file.close()
-
-    return limits
+        return volumeLimits(constraint)
 
 
 
@@ -317,7 +586,280 @@ def visualizeDataStruct(dataObject):
     return 
 
 
-def generatePositions(constraintObj, dynamicObj, randomType, count):
+#fixed, non axis aligned directions for the inside test, axis aligned rays hit shared edges of boxes far too often
+INSIDE_RAYS = [mathutils.Vector(direction).normalized() for direction in [(1., .37, .11), (-.23, 1., .41), (.31, -.17, 1.)]]
+
+def rayParity(bvh, origin, direction, epsilon, maxHits=1000):
+
+    ''' 1 if a ray from origin crosses the surface an odd number of times (origin inside a closed mesh), else 0 '''
+
+    hits = 0
+    while hits < maxHits:
+        location, _, _, _ = bvh.ray_cast(origin, direction)
+        if location is None: break
+
+        hits += 1
+        origin = location + direction * epsilon     #step past the face that was just hit
+
+    return hits % 2
+
+def isInside(bvh, point, epsilon, rays=INSIDE_RAYS):
+
+    ''' majority vote of parity tests along several directions, a single ray grazing an edge or vertex can miscount '''
+
+    point = mathutils.Vector(point)
+    votes = sum(rayParity(bvh, point, direction, epsilon) for direction in rays)
+
+    return 2*votes > len(rays)
+
+def sampleMeshVolume(constraintObj, count, randomType='uniform', mean=None, batch=256, maxCandidates=10**7):
+
+    ''' rejection sample count world space points inside a closed mesh
+
+        PARAMS:
+            randomType:     <'uniform', 'normal'>   'normal' is centered at mean with sigma of a third of the box extent
+            batch:          <int>   first batch size, later batches are sized from the acceptance ratio so far
+            maxCandidates:  <int>   give up (ValueError) once this many candidates were drawn
+
+        Returns ((count, 3) array of points, number of candidates drawn) '''
+
+    entry = CONSTRAINT_CACHE.get(constraintObj)
+    bvh, low, high = entry['bvh'], entry['low'], entry['high']
+    if bvh is None:
+        raise ValueError(f'{constraintObj.name}: constraint has no faces, cannot sample a volume')
+    epsilon = 1e-6 * max(float(np.linalg.norm(high - low)), 1e-9)
+
+    if mean is None: mean = (low + high) / 2
+    mean = np.asarray(mean, dtype=np.float64)
+
+    accepted = []
+    drawn = 0
+    size = batch
+
+    while len(accepted) < count:
+        if drawn >= maxCandidates:
+            raise ValueError(f'{constraintObj.name}: only {len(accepted)} of {count} points inside after {drawn} candidates, is the mesh closed?')
+
+        #draw enough candidates for the points still missing at the acceptance ratio so far (+25%), double while nothing was accepted
+        if accepted: size = int(np.clip(1.25 * (count - len(accepted)) * drawn / len(accepted), 16, 65536))
+        elif drawn: size = min(2*size, 65536)
+
+        if randomType == 'normal':
+            candidates = np.random.normal(mean, (high - low) / 3, size=(size, 3))
+            candidates = candidates[np.all((candidates >= low) & (candidates <= high), axis=1)]
+            drawn += size - len(candidates)     #outside the box, rejected without a ray
+        else:
+            candidates = np.random.uniform(low, high, size=(size, 3))
+
+        for point in candidates:
+            drawn += 1
+            if isInside(bvh, point, epsilon):
+                accepted.append(point)
+                if len(accepted) == count: break
+
+    return np.array(accepted).reshape(-1, 3), drawn
+
+def sampleCurve(constraintObj, count, randomType='uniform', mean=None):
+
+    ''' draw count world space points along the edges of an evaluated curve, uniform in arc length
+
+        Arc length parameters are drawn in one call and mapped to their edge with a binary search of the cached
+        cumulative length table, then interpolated linearly along that edge.
+
+        PARAMS:
+            randomType:     <'uniform', 'normal'>   'normal' is centered at the curve point nearest to mean with sigma of a
+                                                    sixth of the curve length, clipped to the ends of the curve
+
+        Returns (count, 3) array of points '''
+
+    entry = CONSTRAINT_CACHE.get(constraintObj)
+    vertices, edges, arcLengths = entry['vertices'], entry['edges'], entry['arcLengths']
+
+    total = arcLengths[-1]
+    if len(edges) == 0 or total <= 0:
+        raise ValueError(f'{constraintObj.name}: curve has no length, cannot sample along it')
+
+    if randomType == 'normal':
+        #arc length at the middle of the edge nearest to the mean
+        if mean is None: center = total / 2
+        else:
+            midpoints = (vertices[edges[:, 0]] + vertices[edges[:, 1]]) / 2
+            nearest = np.argmin(np.linalg.norm(midpoints - np.asarray(mean, dtype=np.float64), axis=1))
+            center = (arcLengths[nearest] + arcLengths[nearest + 1]) / 2
+        lengths = np.clip(np.random.normal(center, total / 6, size=count), 0, total)
+    else:
+        lengths = np.random.uniform(0, total, size=count)
+
+    #edge k holds arc lengths [arcLengths[k], arcLengths[k + 1])
+    idx = np.clip(np.searchsorted(arcLengths, lengths, side='right') - 1, 0, len(edges) - 1)
+
+    edgeLengths = arcLengths[idx + 1] - arcLengths[idx]
+    t = np.divide(lengths - arcLengths[idx], edgeLengths, out=np.zeros(count), where=edgeLengths > 0)
+
+    start, stop = vertices[edges[idx, 0]], vertices[edges[idx, 1]]
+
+    return start + t[:, None] * (stop - start)
+
+def sampleSurface(constraintObj, count, randomType='uniform', mean=None):
+
+    ''' draw count world space points on the surface of a mesh, uniform in area, no rejection
+
+        A triangle is picked per point with a binary search of the cached cumulative area table, then a point
+        inside it with the square root barycentric mapping (uniform over the triangle).
+
+        PARAMS:
+            randomType:     <'uniform', 'normal'>   'normal' weights triangles by a gaussian of their centroid distance to
+                                                    mean, sigma of a third of the surface extent
+
+        Returns (count, 3) array of points '''
+
+    entry = CONSTRAINT_CACHE.get(constraintObj)
+    vertices, triangles, areaTable = entry['vertices'], entry['triangles'], entry['areaTable']
+
+    if len(triangles) == 0 or areaTable[-1] <= 0:
+        raise ValueError(f'{constraintObj.name}: constraint has no surface area, cannot sample on it')
+
+    if randomType == 'normal' and mean is not None:
+        corners = vertices[triangles]
+        sigma = max(float(np.linalg.norm(entry['high'] - entry['low'])), 1e-9) / 3
+        distance = np.linalg.norm(corners.mean(axis=1) - np.asarray(mean, dtype=np.float64), axis=1)
+        areaTable = np.concatenate([[0.], np.cumsum(entry['areas'] * np.exp(-0.5*(distance/sigma)**2))])
+        if areaTable[-1] <= 0: areaTable = entry['areaTable']
+
+    #triangle m holds cumulative area [areaTable[m], areaTable[m + 1])
+    picks = np.random.uniform(0, areaTable[-1], size=count)
+    idx = np.clip(np.searchsorted(areaTable, picks, side='right') - 1, 0, len(triangles) - 1)
+
+    a, b, c = (vertices[triangles[idx, k]] for k in range(3))
+    r1 = np.sqrt(np.random.uniform(size=(count, 1)))
+    r2 = np.random.uniform(size=(count, 1))
+
+    return (1 - r1) * a + r1 * (1 - r2) * b + r1 * r2 * c
+
+def voxelGrid(constraintObj, resolution=32, cacheDir=None):
+
+    ''' occupancy grid of a closed constraint mesh, cubic voxels with resolution cells along the longest AABB axis
+
+        Voxels within half a diagonal of the surface (BVH find_nearest) are boundary voxels. Every other voxel is entirely
+        inside or entirely outside, a run of them along x shares one parity test. Grids are kept in the constraint cache
+        and, with cacheDir, in <cacheDir><name>_<hash>.voxels.npz keyed by the world space mesh and resolution.
+
+        Returns dict:
+            low:        (3,)   grid origin
+            size:       ()     voxel edge length
+            shape:      (3,)   voxels per axis
+            interior:   (I,)   flat indices of voxels fully inside
+            boundary:   (B,)   flat indices of voxels touching the surface '''
+
+    entry = CONSTRAINT_CACHE.get(constraintObj)
+    grids = entry.setdefault('voxels', dict())
+    if resolution in grids:
+        return grids[resolution]
+
+    bvh = entry['bvh']
+    if bvh is None:
+        raise ValueError(f'{constraintObj.name}: constraint has no faces, cannot voxelize a volume')
+
+    path = None
+    if cacheDir:
+        digest = hashlib.sha1(entry['vertices'].tobytes() + entry['triangles'].tobytes() + str(resolution).encode()).hexdigest()[:16]
+        path = cacheDir.rstrip('/') + '/' + f'{constraintObj.name}_{digest}.voxels.npz'
+
+    if path and os.path.exists(path):
+        grid = loadArrays(path)
+
+    else:
+        low, high = entry['low'], entry['high']
+        size = max(float((high - low).max()), 1e-9) / resolution
+        shape = np.maximum(np.ceil((high - low) / size).astype(np.int64), 1)
+        epsilon = 1e-6 * max(float(np.linalg.norm(high - low)), 1e-9)
+
+        ijk = np.stack(np.unravel_index(np.arange(int(np.prod(shape))), shape), axis=1)
+        centers = low + (ijk + 0.5) * size
+
+        halfDiagonal = np.sqrt(3) / 2 * size
+        boundary = np.array([bvh.find_nearest(mathutils.Vector(center), halfDiagonal)[0] is not None for center in centers])
+
+        #one parity test per run of non boundary voxels along x, the surface never passes between them
+        inside = np.zeros(len(centers), dtype=bool)
+        rows = boundary.reshape(shape[0], -1)
+        for column in range(rows.shape[1]):
+            row = rows[:, column]
+            starts = np.flatnonzero(~row & np.concatenate([[True], row[:-1]]))
+            for start in starts:
+                stop = start + (np.argmax(row[start:]) if row[start:].any() else len(row) - start)
+                flat = np.ravel_multi_index((np.arange(start, stop), *np.unravel_index(column, shape[1:])), shape)
+                inside[flat] = isInside(bvh, centers[flat[0]], epsilon)
+
+        grid = {'low':      low,
+                'size':     np.array(size),
+                'shape':    shape,
+                'interior': np.flatnonzero(inside),
+                'boundary': np.flatnonzero(boundary)}
+
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            saveArrays(path, grid)
+
+    grids[resolution] = grid
+
+    return grid
+
+def sampleVoxels(constraintObj, count, grid, randomType='uniform', mean=None, maxCandidates=10**7):
+
+    ''' draw count world space points inside a closed mesh from its voxelGrid, occupied voxels are picked at random
+        and a point jittered inside, only points in boundary voxels get the exact BVH test. Acceptance is bounded below by
+        the share of interior voxels instead of the share of the AABB the mesh fills.
+
+        PARAMS:
+            randomType:     <'uniform', 'normal'>   'normal' weights voxels by a gaussian of their distance to mean with sigma
+                                                    of a third of the box extent, like sampleMeshVolume
+
+        Returns ((count, 3) array of points, number of candidates drawn) '''
+
+    entry = CONSTRAINT_CACHE.get(constraintObj)
+    bvh, low, high = entry['bvh'], entry['low'], entry['high']
+    epsilon = 1e-6 * max(float(np.linalg.norm(high - low)), 1e-9)
+
+    occupied = np.concatenate([grid['interior'], grid['boundary']])
+    interiorCount = len(grid['interior'])
+    if len(occupied) == 0:
+        raise ValueError(f'{constraintObj.name}: voxel grid is empty, is the mesh closed?')
+
+    size, shape = float(grid['size']), grid['shape']
+    corners = grid['low'] + np.stack(np.unravel_index(occupied, shape), axis=1) * size
+
+    weights = None
+    if randomType == 'normal':
+        if mean is None: mean = (low + high) / 2
+        sigma = np.maximum((high - low) / 3, 1e-9)
+        weights = np.exp(-0.5 * (((corners + size/2 - np.asarray(mean, dtype=np.float64)) / sigma)**2).sum(axis=1))
+        weights = weights / weights.sum()
+
+    accepted = []
+    have = 0
+    drawn = 0
+
+    while have < count:
+        if drawn >= maxCandidates:
+            raise ValueError(f'{constraintObj.name}: only {have} of {count} points inside after {drawn} candidates')
+
+        #boundary voxels are the only source of rejections, draw a quarter more than missing
+        batch = int(1.25 * (count - have)) + 16
+        picks = np.random.choice(len(occupied), size=batch, p=weights)
+        points = corners[picks] + np.random.uniform(0, size, size=(batch, 3))
+
+        keep = picks < interiorCount
+        for k in np.flatnonzero(~keep):
+            keep[k] = isInside(bvh, points[k], epsilon)
+
+        drawn += batch
+        accepted.append(points[keep])
+        have += int(keep.sum())
+
+    return np.concatenate(accepted)[:count], drawn
+
+def generatePositions(constraintObj, dynamicObj, randomType, count, voxels=None):
 
     """ This function is designed to generate position coordinates that respect constraint boundaries.
 
@@ -327,151 +869,361 @@ def generatePositions(constraintObj, dynamicObj, randomType, count):
         dynamicObj:     <object pointer>        to the part for which we want to move, this is only used to identify intial location
         randomType:     <'uniform', 'normal'>   Logic for point distribution, <normal> will use dynamic object init location as mean
         count:          <int>                   Number of required positions
+        voxels:         <None, dict>            closed 'MESH' only, eg. {'resolution': 32, 'cacheDir': path}, sample from an
+                                                occupancy grid (see voxelGrid) instead of the bounding box, for thin or very
+                                                non convex volumes
 
     constraint types:
 
-        'CURVE' constraints: TBD
-                - should lerp along curves using the type of curve, ie bezier with control points
+        'CURVE' constraints:
+                - points are spread uniformly by arc length along the evaluated (tessellated) curve, see sampleCurve,
+                  the curve resolution sets how closely the edges follow the true spline
 
-        'PLANE' constraints: TBD
-                - should utilize formula for the plane, then ray cast away from origin to detirmine bound success
+        'PLANE' constraints, and 'MESH' constraints that are not closed (planes, open sheets):
+                - points are spread uniformly by area over the triangulated surface, see sampleSurface
 
-        'MESH'  constraints: 
-                - function uses ray casting to detirmine coordinate positions within a volume
-                - this is not perfect, right now i cast rays using a unit vector in the direction from the origin to the potential point
-                  for non-convex geometries there is a posibility that the ray is still intercepted on the part even though the point is 
-                  outside of the constraint limits. for now this is good enough though to move forward, but should return to this in the 
-                  future to improve fucntionality """
+        'MESH'  constraints (closed): 
+                - candidates are drawn in numpy batches inside the world space bounding box and kept if a parity (even/odd
+                  crossing) test against a BVH of the closed constraint mesh says they are inside, see sampleMeshVolume
+                - always returns exactly count points, raises if the mesh has no interior (eg. not closed) """
     
-    goodPoints = []
-
     if constraintObj.type == 'CURVE':
 
-        potentialPositions = []
-        
-        bpy.ops.object.select_all(action='DESELECT')
-        constraintObj.select_set(True)
+        points = sampleCurve(constraintObj, count, randomType=randomType, mean=dynamicObj.location)
+
+        return [mathutils.Vector(point) for point in points]
+
+    if constraintObj.type == 'PLANE' or (constraintObj.type == 'MESH' and not CONSTRAINT_CACHE.get(constraintObj)['closed']):
+
+        points = sampleSurface(constraintObj, count, randomType=randomType, mean=dynamicObj.location)
+
+        return [mathutils.Vector(point) for point in points]
 
-        mCurve = constraintObj.to_mesh(preserve_all_data_layers=True)
+    if constraintObj.type == 'MESH':
 
-        #build list of all vertex positions in world frame
-        for vert in mCurve.vertices:
-            coord = vert.co
-            potentialPositions.append(constraintObj.matrix_world @ coord)
+        if voxels:
+            grid = voxelGrid(constraintObj, **voxels)
+            points, drawn = sampleVoxels(constraintObj, count, grid, randomType=randomType, mean=dynamicObj.location)
+        else:
+            points, drawn = sampleMeshVolume(constraintObj, count, randomType=randomType, mean=dynamicObj.location)
+        print(f'{constraintObj.name}: accepted {count} of {drawn} candidates ({count/max(drawn, 1):.1%})')
 
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.ops.object.delete()
+        return [mathutils.Vector(point) for point in points]
     
-        #generate a random list if indicies to pull from 
-        selectionList = np.random.randint(low= 0, high=len(potentialPositions), size=count)
 
-        #build list of actual postions, this may have duplicates from the postential position list of the desired numbber of positions
-        # is greater than the number of vertecies that are require to define the curve mesh
-        for selection in selectionList:
-            goodPoints.append(potentialPositions[selection])
+def planColumn(values, count):
 
-        return goodPoints
-            
+    ''' (count, 3) float array from a list of positions/rotations, rows that were not sampled (eg. the sampler gave up
+        early or returned None) are nan '''
 
-    if constraintObj.type == 'PLANE':
-        return
+    column = np.full((count, 3), np.nan)
+    if values:
+        values = np.array([list(value) for value in values[:count]], dtype=np.float64)
+        column[:len(values)] = values
 
-    if constraintObj.type == 'MESH':
+    return column
 
-        #dependency graph, needed for ray casting
-        depsgraph = bpy.context.evaluated_depsgraph_get()
+def checkPlan(plan, path=''):
 
-        #ensure mesh for vertecies
-        mesh = constraintObj.to_mesh(preserve_all_data_layers=True)
+    ''' raise ValueError if a pose column of a scene plan is missing rows. Camera and light poses are sampled for every
+        row, object columns are nan only where the object keeps its place: for every row of a class, or none of them '''
 
-        #deselect all
-        bpy.ops.object.select_all(action='DESELECT')
+    for key, column in plan.items():
+        if not key.endswith(('location', 'rotation')) or column.dtype.kind != 'f':
+            continue
 
-        #select constraint object
-        constraintObj.select_set(True)
+        missing = np.isnan(column)
+        bad = missing.any(axis=1)
 
-        #save initial object origin location
-        constraintInitLoc = constraintObj.location
-        bpy.context.scene.cursor.location = constraintInitLoc
-        
-        #set origin to center of mass
-        bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_MASS')
-        worldOrigin = constraintObj.location
+        if key.startswith('object/'):
+            klasses = plan.get(key.rsplit('/', 1)[0] + '/class', np.zeros(len(column), dtype=np.int64))
+            for klass in np.unique(klasses):
+                rows = klasses == klass
+                if missing[rows].all(): bad[rows] = False
 
-        #reset origin to original position
-        bpy.ops.object.origin_set(type='ORIGIN_CURSOR')
+        if bad.any():
+            raise ValueError(f'scene plan {path} {key}: {int(bad.sum())} rows without a pose, first row {int(np.argmax(bad))}')
 
-        #store init location of moving object for 'normal' distribution
-        dynamicInitLoc = dynamicObj.location
+def saveArrays(path, arrays):
 
-        #possible ranges without obeying geometry constraint yet
-        min_x, max_x = min(v.co.x for v in mesh.vertices), max(v.co.x for v in mesh.vertices)
-        min_y, max_y = min(v.co.y for v in mesh.vertices), max(v.co.y for v in mesh.vertices)
-        min_z, max_z = min(v.co.z for v in mesh.vertices), max(v.co.z for v in mesh.vertices)
-        
-        # collect good points
-        attempt = 0
-        while len(goodPoints) < count:
-
-            if randomType == 'uniform':
-
-                # ray cast requires point type to be a tuple
-                point = (
-                        random.uniform(min_x, max_x),
-                        random.uniform(min_y, max_y),
-                        random.uniform(min_z, max_z)
-                        )
-                
-            if randomType == 'normal':
-
-                # ray cast requires point type to be a tuple
-                point = (
-                        random.normalvariate(dynamicInitLoc[0], abs(max_x - min_x)/3),
-                        random.normalvariate(dynamicInitLoc[1], abs(max_y - min_y)/3),
-                        random.normalvariate(dynamicInitLoc[2], abs(max_z - min_z)/3)
-                        )
-                
-                #clamp to constraint limits
-                #TODO: add decay term to ensure these terminate
-                while (point[0] < min_x) or (point[0] > max_x): point[0] = random.normalvariate(dynamicInitLoc[0], abs(max_x - min_x)/3)
-                while (point[1] < min_y) or (point[1] > max_y): point[1] = random.normalvariate(dynamicInitLoc[1], abs(max_y - min_y)/3)
-                while (point[2] < min_z) or (point[2] > max_z): point[2] = random.normalvariate(dynamicInitLoc[2], abs(max_z - min_z)/3)
-                
-            #must convert tuple to vector
-            pointVec = mathutils.Vector(point)
-
-            #convert local coordinate to world frame
-            worldPoint = constraintObj.matrix_world @ pointVec
-           
-            #vector from center of mass to new random point
-            origin2Point = worldPoint - pointVec
-            mag = np.sqrt(origin2Point[0]**2 + origin2Point[1]**2 + origin2Point[2]**2)
-            unitVec = (origin2Point[0]/mag, origin2Point[1]/mag, origin2Point[2]/mag)
-           
-            #cast ray, if ray hits a face of the object, poly_idx will be positive, else -1
-            _, _, _, poly_idx = constraintObj.evaluated_get(depsgraph).ray_cast(point, unitVec)
-
-            #store good points
-            if poly_idx != -1:
-                goodPoints.append(worldPoint)
-
-            #TODO: update this to handle use casses where more than 500 points are desired
-            if attempt > 500:
-                break
-
-            attempt += 1
-
-        return goodPoints
-    
+    ''' write {key: array} to a single .npz, written to a temp file first so a crash never leaves half a file '''
+
+    with open(path + '.tmp', 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(path + '.tmp', path)
+
+def loadArrays(path):
+
+    ''' returns {key: array} saved by saveArrays, no pickled objects '''
+
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def savePlan(path, plan):
+
+    ''' write a scene plan {key: array} to a single .npz (see saveArrays), checked first '''
+
+    checkPlan(plan, path)
+    saveArrays(path, plan)
+
+def loadPlan(path):
+
+    ''' returns scene plan dict saved by savePlan '''
+
+    plan = loadArrays(path)
+    checkPlan(plan, path)
+
+    return plan
+
+def setMaterialSlot(obj, idx):
+
+    ''' move material slot idx to the front, remaining slots keep their order '''
+
+    #NOTE: there exists bpy.ops.object.material_slot_select() which should make a desired material the active one, however this errors on my version, \
+    #        therefore resorting to reordering loop as insert doesnt work
+    holder = [obj.material_slots[idx].material]
+    for j in range(len(obj.material_slots)):
+        if j != idx:
+            holder.append(obj.material_slots[j].material)
+
+    for j in range(len(obj.material_slots)):
+        obj.material_slots[j].material = holder[j]
+
+IMAGE_EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp'}
+
+#options compared by benchmarkFormats when none are given
+BENCHMARK_FORMATS = [{'format': 'PNG', 'colorDepth': '8', 'compression': 0},
+                     {'format': 'PNG', 'colorDepth': '8', 'compression': 15},
+                     {'format': 'PNG', 'colorDepth': '8', 'compression': 50},
+                     {'format': 'PNG', 'colorDepth': '8', 'compression': 90},
+                     {'format': 'PNG', 'colorDepth': '16', 'compression': 15},
+                     {'format': 'JPEG', 'quality': 95},
+                     {'format': 'JPEG', 'quality': 85},
+                     {'format': 'WEBP', 'quality': 90},
+                     {'format': 'WEBP', 'quality': 100}]
+
+def setImageFormat(scene, imageFormat):
+
+    ''' apply output image options to the scene, returns the file extension
+
+        imageFormat:    {'format':      <'PNG', 'JPEG', 'WEBP'>,
+                         'colorMode':   <'RGB', 'RGBA', 'BW'>   default keeps the scene's mode, RGBA becomes RGB for JPEG
+                         'colorDepth':  <'8', '16'>             16 bit only for PNG
+                         'compression': <int [0, 100]>          PNG zlib effort, lossless
+                         'quality':     <int [0, 100]>          JPEG / WEBP} '''
+
+    fileFormat = imageFormat.get('format', 'PNG')
+    if fileFormat not in IMAGE_EXTENSIONS:
+        raise ValueError(f"unsupported image format {fileFormat}, expected one of {list(IMAGE_EXTENSIONS.keys())}")
+
+    settings = scene.render.image_settings
+    colorMode = imageFormat.get('colorMode', settings.color_mode)
+
+    #format first, valid color modes and depths depend on it, JPEG has no alpha channel
+    settings.file_format = fileFormat
+    if fileFormat == 'JPEG' and colorMode == 'RGBA': colorMode = 'RGB'
+    settings.color_mode = colorMode
+    if fileFormat == 'PNG':
+        settings.color_depth = str(imageFormat.get('colorDepth', '8'))
+        settings.compression = imageFormat.get('compression', 15)
+    else:
+        settings.quality = imageFormat.get('quality', 90)
+
+    return IMAGE_EXTENSIONS[fileFormat]
+
+def benchmarkFormats(scene, formats=None, repeats=3):
+
+    ''' render the current frame once, then encode it with every option in formats (default BENCHMARK_FORMATS)
+        and report encode time and bytes per frame, scene image settings are restored afterwards
+
+        returns list of {'imageFormat': options, 'seconds': best encode time of repeats, 'bytes': file size} '''
+
+    if formats is None: formats = BENCHMARK_FORMATS
+
+    settings = scene.render.image_settings
+    initial = {'format': settings.file_format, 'colorMode': settings.color_mode, 'colorDepth': settings.color_depth,
+               'compression': settings.compression, 'quality': settings.quality}
+
+    bpy.ops.render.render()
+    image = bpy.data.images['Render Result']
+    directory = tempfile.mkdtemp(prefix='formatBenchmark_')
+
+    results = []
+    try:
+        for imageFormat in formats:
+            #every option starts from the scene's color mode, a JPEG option before it would leave RGB behind
+            path = os.path.join(directory, 'frame' + setImageFormat(scene, dict({'colorMode': initial['colorMode']}, **imageFormat)))
+
+            times = []
+            for _ in range(repeats):
+                startTime = time.time()
+                image.save_render(path, scene=scene)
+                times.append(time.time() - startTime)
+
+            results.append({'imageFormat': imageFormat, 'seconds': min(times), 'bytes': os.path.getsize(path)})
+            print(f"{str(imageFormat):<70} {min(times)*1000:8.1f} ms  {os.path.getsize(path)/1024:10.1f} KiB")
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+        settings.file_format = initial['format']
+        settings.color_mode = initial['colorMode']
+        settings.color_depth = initial['colorDepth']
+        settings.compression = initial['compression']
+        settings.quality = initial['quality']
+
+    return results
+
+class asyncWriter():
+
+    ''' runs output tasks (file copies, csv rows, json, journal commits) on a background thread in submit order, so
+        disk io of frame i overlaps the render of frame i + 1. bpy calls are not thread safe, only submit plain python work
+
+        PARAMS:
+            maxQueue:   <int>   tasks buffered before submit blocks the render loop, bounds memory when io falls behind
+            threaded:   <bool>  False runs every task inline on submit, same semantics without the thread
+
+        After a task fails every later task is dropped (a journal commit never follows a failed write) and the error is
+        raised on the next submit, flush or close. close is registered with atexit so queued tasks are written at exit '''
+
+    def __init__(self, maxQueue=32, threaded=True):
+
+        self.error = None
+        self.threaded = threaded
+
+        if threaded:
+            self.queue = queue.Queue(maxsize=maxQueue)
+            self.thread = threading.Thread(target=self.run, name='asyncWriter', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def run(self):
+
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                if self.error is None:
+                    fn, args, kwargs = task
+                    fn(*args, **kwargs)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+
+        if self.error is not None:
+            raise RuntimeError('background output writer failed, later output was not written') from self.error
+
+    def submit(self, fn, *args, **kwargs):
+
+        ''' queue fn(*args, **kwargs), blocks while the queue is full '''
+
+        self.check()
+
+        if self.threaded: self.queue.put((fn, args, kwargs))
+        else: fn(*args, **kwargs)
+
+    def pending(self):
+
+        ''' number of submitted tasks not yet run '''
+
+        return self.queue.unfinished_tasks if self.threaded and self.thread.is_alive() else 0
+
+    def flush(self):
+
+        ''' block until every submitted task has run '''
+
+        if self.threaded: self.queue.join()
+        self.check()
+
+    def close(self):
+
+        ''' run remaining tasks and stop the thread, safe to call more than once '''
+
+        if self.threaded and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+            atexit.unregister(self.close)
+        self.check()
+
+class runJournal():
+
+    ''' append only journal of committed frames for crash safe resume
+
+        first line is a header {'seed': ..., 'count': ...}, then one record per frame written only after the
+        render, csv rows and projection data of that frame are on disk:
+
+            {'frame': i, 'poses': {...}, 'materials': {...}, 'rows': [csv rows], 'coordinates': [...] (optional)} '''
+
+    def __init__(self, path):
+
+        self.path = path
+        self.file = None
+
+    def load(self):
+
+        ''' returns (header, list of frame records), (None, []) if there is no journal. Records are cut at the first
+            gap or unreadable line so resume always continues from a contiguous prefix '''
+
+        if not os.path.exists(self.path):
+            return None, []
+
+        header = None
+        records = []
+
+        with open(self.path, 'r') as file:
+            for line in file:
+                try: record = json.loads(line)
+                except json.JSONDecodeError: break   #torn last line from a crash
+
+                if header is None:
+                    header = record
+                elif record['frame'] == len(records):
+                    records.append(record)
+                else:
+                    break
+
+        return header, records
+
+    def start(self, header, records=None):
+
+        ''' rewrite journal with header and already committed records, then keep it open for commits '''
+
+        with open(self.path + '.tmp', 'w') as file:
+            file.write(json.dumps(header) + '\n')
+            for record in records or []:
+                file.write(json.dumps(record) + '\n')
+        os.replace(self.path + '.tmp', self.path)
+
+        self.file = open(self.path, 'a')
+
+    def commit(self, record):
+
+        ''' append a frame record and force it to disk '''
+
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file: self.file.close()
+
+def timeRemaining(renderCount, currentIter, iterElapsed, average=None):
 
-def timeRemaining(renderCount, currentIter, iterElapsed):
+    ''' nice way to check in on progress for long render tasks
 
-    ''' nice way to check in on progress for long render tasks '''
+        average:    seconds per frame to extrapolate with (eg. instrumentation.frameTimer EWMA), None uses iterElapsed
+        returns (seconds per frame used, progress bar, estimate string) '''
 
     remainingBar = '['
-    avg = 0
+    avg = iterElapsed if average is None else average
 
-    percentComplete = int((currentIter/renderCount) * 10)
+    #currentIter is 0 based, it is finished when this is called
+    done = currentIter + 1
+    percentComplete = int((done/renderCount) * 10)
 
     for i in range(percentComplete):
         remainingBar = remainingBar + '#'
@@ -481,7 +1233,7 @@ def timeRemaining(renderCount, currentIter, iterElapsed):
     
     remainingBar = remainingBar + ']'
 
-    totalSeconds = int(iterElapsed * (renderCount - currentIter))
+    totalSeconds = int(avg * (renderCount - done))
     minutesRemain = round(totalSeconds/60, 2)
 
     estimate = f'remaining minutes: {minutesRemain}'
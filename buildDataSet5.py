@@ -1,10 +1,16 @@
-import cv2 as cv
 import numpy as np
 import pandas as pd
 import json
 import random
 import copy
+import os
+import io
+import gzip
+import contextlib
 import dataTools #this is a personal module
+import projectionStore
+import renderManifest
+import instrumentation
 
 
 '''Version 3: built for the following data set struct:
@@ -21,142 +27,475 @@ import dataTools #this is a personal module
 
 
 
-def main(fileName, renderCount, rootDir, renderPath, vertexPath, csvPath, jsonPath, gcpPath, split):
-    
-    
-    #dataTools.rotateImageDirectory(renderPath=renderPath)
-    
-    #.npy file that stores all projection matricies (output from blender)
-    vertMat = np.load(vertexPath, allow_pickle=True)
+def writeCsvAtomic(data_csv, csvPath):
+
+    ''' write data_csv to a temp file next to csvPath then rename over it, an interrupted write never leaves a
+        half written csv behind '''
+
+    tempPath = csvPath + '.tmp'
+
+    with open(tempPath, 'w', newline='') as file:
+        data_csv.to_csv(file, index=False)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(tempPath, csvPath)
+
+def gcpCsvName(csvPath):
+
+    ''' built csv next to the generator csv, csvFile/<fileName>.csv -> csvFile/<fileName>_gcp.csv '''
+
+    return (csvPath[:-len('.csv')] if csvPath.endswith('.csv') else csvPath) + '_gcp.csv'
+
+def writeCheckpoint(data_csv, csvPath, nextImage):
+
+    ''' save partially built csv and the index of the next image to process, see main(resume=True) '''
+
+    writeCsvAtomic(data_csv, csvPath + '.partial')
+
+    tempPath = csvPath + '.checkpoint.tmp'
+    with open(tempPath, 'w') as file:
+        json.dump({'nextImage': nextImage}, file)
+    os.replace(tempPath, csvPath + '.checkpoint.json')
+
+def loadCheckpoint(csvPath):
+
+    ''' returns (partial data_csv, nextImage) or (None, 0) if there is no checkpoint for csvPath '''
+
+    if not os.path.exists(csvPath + '.checkpoint.json'):
+        return None, 0
+
+    with open(csvPath + '.checkpoint.json', 'r') as file:
+        nextImage = json.load(file)['nextImage']
+
+    return pd.read_csv(csvPath + '.partial', float_precision='round_trip'), nextImage
+
+def clearCheckpoint(csvPath):
+
+    ''' remove checkpoint files once the build has been committed '''
+
+    for path in [csvPath + '.partial', csvPath + '.checkpoint.json']:
+        if os.path.exists(path): os.remove(path)
+
+def boxAnnotation(displayName, xMin, xMax, yMin, yMax):
+
+    ''' vertex AI GCP bbox annotation for a single instance '''
+
+    annotationResourceLabels = dict({"airplatform.googleapis.com/annotation_set_name":"7787165759397953536"})
+
+    return dict({"displayName":displayName,
+                 "xMin":xMin,
+                 "xMax":xMax,
+                 "yMin":yMin,
+                 "yMax":yMax,
+                 "annotationResourceLabels":annotationResourceLabels})
+
+def jsonRecord(boundingBoxAnnotations, TTV, imageGcsUri):
+
+    ''' vertex AI GCP record for one render, boundingBoxAnnotations holds every instance in the image '''
+
+    dataItemResourceLabels = dict({"airplatform.googleapis.com/ml_use":TTV})
+
+    return {"imageGcsUri":imageGcsUri,
+            "boundingBoxAnnotations":boundingBoxAnnotations,
+            "dataItemResourceLabels":dataItemResourceLabels}
+
+class jsonlWriter():
+
+    ''' streams json records to <path>.jsonl (or .jsonl.gz) as soon as they are computed, keeps memory flat
+        regardless of dataset size. Records go to a temp file that is renamed over path on close()
+
+        PARAMS:
+            path:           output .jsonl path
+            compress:       <bool>  gzip output, '.gz' is appended to path
+            bufferSize:     <int>   bytes buffered before hitting disk '''
+
+    def __init__(self, path, compress=False, bufferSize=1 << 20):
+
+        if compress: path += '.gz'
+
+        self.path = path
+        self.tempPath = path + '.tmp'
+        self.count = 0
+
+        self.raw = open(self.tempPath, 'wb', buffering=bufferSize)
+        if compress: stream = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        else: stream = self.raw
+        self.file = io.TextIOWrapper(stream, encoding='utf-8', write_through=True)
+
+    def write(self, record):
+
+        ''' append one record as a single compact json line '''
+
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.count += 1
+
+    def close(self):
+
+        ''' flush everything to disk and move the finished file into place '''
+
+        self.file.close()   #closes gzip stream, raw file stays open when compressed
+        if not self.raw.closed:
+            self.raw.flush()
+            os.fsync(self.raw.fileno())
+            self.raw.close()
 
-    #csv object
-    data_csv = pd.read_csv(csvPath)
-    classification = data_csv.loc[0, "classification"]
+        os.replace(self.tempPath, self.path)
 
+    def abort(self):
 
-    #list for storing json objects, will be converted to .jsonl
-    data_json_list = []
+        ''' close the handles without publishing anything, the temp file is removed and path is left untouched '''
 
-    tempfileName = data_csv.loc[0, 'fileName']
-    print(tempfileName)
+        for stream in [self.file, self.raw]:
+            try: stream.close()
+            except Exception: pass
 
-    #get image resolutions
-    imgPath = renderPath + tempfileName
-    img = cv.imread(imgPath, 1)
+        if os.path.exists(self.tempPath):
+            os.remove(self.tempPath)
 
-    resolutionY, resolutionX = np.shape(img)[0], np.shape(img)[1]
+    def __enter__(self):
+        return self
 
-    print(f'xRes: { resolutionX}, yRes: {resolutionY}')
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None: self.close()
+        else: self.abort()
 
-    #random index splits based on split requirements
-    train_index, test_index, validation_index = dataTools.splitData(renderCount, split)
-    print(f"train_index: {train_index}, test_index:{test_index}, validation_index:{validation_index}")
+def padProjections(vertMat):
 
-    numberOfImages = np.shape(vertMat)[0]
-    print(numberOfImages)
+    ''' converts the ragged [image][object][vertex] projection array saved by syntheticGen1 into a padded
+        (images, objects, maxVertices, 3) float array plus a (images, objects, maxVertices) validity mask '''
+
+    if vertMat.dtype != object:
+        vertices = np.asarray(vertMat, dtype=np.float64)
+        return vertices, np.ones(vertices.shape[:3], dtype=bool)
+
+    numberOfImages, numberOfObjects = np.shape(vertMat)[0], np.shape(vertMat)[1]
+
+    cells = [np.asarray(vertMat[i][j], dtype=np.float64).reshape(-1, 3) for i in range(numberOfImages) for j in range(numberOfObjects)]
+    lengths = np.array([len(cell) for cell in cells]).reshape(numberOfImages, numberOfObjects)
+
+    mask = np.arange(lengths.max()) < lengths[..., None]
+    vertices = np.zeros(mask.shape + (3,), dtype=np.float64)
+    vertices[mask] = np.concatenate(cells)
+
+    return vertices, mask
+
+def projectionBoxes(vertices, mask):
+
+    ''' returns (images, objects, 4) pixel bboxes [xMin, xMax, yMin, yMax] from padded projections,
+        coordinates are int truncated like the original set based search '''
+
+    pixels = np.trunc(vertices[..., :2])
+    valid = mask[..., None]
+
+    mins = np.where(valid, pixels, np.inf).min(axis=2)
+    maxs = np.where(valid, pixels, -np.inf).max(axis=2)
+
+    return np.stack([mins[..., 0], maxs[..., 0], mins[..., 1], maxs[..., 1]], axis=-1)
+
+def normalizeBoxes(boxes, resolutionX, resolutionY):
+
+    ''' array version of dataTools.normalizeCoordinates, [xMin, xMax, yMin, yMax] pixels -> [0, 1] image fraction '''
+
+    return boxes / np.array([resolutionX, resolutionX, resolutionY, resolutionY], dtype=np.float64)
+
+def splitLabels(numberOfImages, train_index, test_index, validation_index):
+
+    ''' returns (images,) array of 'train'/'test'/'validation' labels, train wins on overlap like the loop version '''
+
+    labels = np.full(numberOfImages, None, dtype=object)
+    labels[np.asarray(validation_index, dtype=int)] = "validation"
+    labels[np.asarray(test_index, dtype=int)] = "test"
+    labels[np.asarray(train_index, dtype=int)] = "train"
+
+    return labels
+
+def buildNumpy(data_csv, vertMat, numberOfImages, numberOfObjects, resolutionX, resolutionY, labels, gcpPath, fileName):
+
+    ''' vectorized bbox builder, computes every box, normalization and split label with array ops and assigns
+        whole columns to data_csv. Returns iterator of json dicts for the jsonl export, one per image '''
+
+    rowCount = numberOfImages * numberOfObjects
+    if rowCount != len(data_csv):
+        raise ValueError(f'csv has {len(data_csv)} rows, projection data describes {rowCount} instances')
+
+    if isinstance(vertMat, projectionStore.projectionReader):
+        boxes = vertMat.boxes().reshape(rowCount, 4)
+    elif vertMat is not None:
+        vertices, mask = padProjections(vertMat)
+        boxes = projectionBoxes(vertices, mask).reshape(rowCount, 4)
+    else:
+        boxes = data_csv[['xMin', 'xMax', 'yMin', 'yMax']].to_numpy(dtype=np.float64)
+
+    boxes = normalizeBoxes(boxes, resolutionX, resolutionY)
+    uses = np.repeat(labels, numberOfObjects)
+
+    #update csv, one assignment per column
+    data_csv['xMin'] = boxes[:, 0]
+    data_csv['xMax'] = boxes[:, 1]
+    data_csv['yMin'] = boxes[:, 2]
+    data_csv['yMax'] = boxes[:, 3]
+    data_csv['use'] = uses
+    data_csv['fileName'] = gcpPath + data_csv['fileName'].astype(str)
+
+    #group instances by render, rows i*numberOfObjects ... (i+1)*numberOfObjects - 1 belong to image i
+    imageBoxes = boxes.reshape(numberOfImages, numberOfObjects, 4).tolist()
+    imageNames = data_csv['classification'].to_numpy().reshape(numberOfImages, numberOfObjects).tolist()
+    imageUris = data_csv['fileName'].to_numpy()[::numberOfObjects]
+
+    return (jsonRecord([boxAnnotation(displayName, *box) for displayName, box in zip(names, objectBoxes)], TTV, imageGcsUri)
+            for names, objectBoxes, TTV, imageGcsUri in zip(imageNames, imageBoxes, labels, imageUris))
+
+def main(fileName, renderCount, rootDir, renderPath, vertexPath, csvPath, jsonPath, gcpPath, split, engine='numpy', checkpoint=None, resume=False,
+         streamJsonl=True, compressJsonl=False, strictRenders=False, profile=None, gcpCsvPath=None):
+
+    ''' renderCount:  <int, None>         None uses the number of images found in the projection data / csv, an int
+                                          must match it
+        engine:       <'numpy', 'loop'>   'numpy' computes the whole dataset with array ops (see buildNumpy),
+                                            'loop' walks images x objects x vertices in python
+        checkpoint:   <None, int>         'loop' engine only, save progress every n images
+        resume:       <bool>              'loop' engine only, continue from the last checkpoint if one exists
+        streamJsonl:  <bool>              write each jsonl record as soon as it is computed (see jsonlWriter)
+                                          instead of collecting them for dataTools.Json2Jsonl
+        compressJsonl:<bool>              gzip the streamed jsonl
+        strictRenders:<bool>              raise if the render manifest reports missing, truncated or mismatched renders
+        profile:      <None, dict>        cProfile (+ tracemalloc with {'memory': True}) dumps of the load, build and write
+                                          phases in <dataset>/profile/, eg. {'memory': False}
+
+        gcpCsvPath:   <None, path>        built csv (normalized boxes, split labels, gcp file names), default
+                                          csvFile/<fileName>_gcp.csv. The generator csv at csvPath is only read, with
+                                          'stream' annotation it is the only copy of the pixel boxes
+
+        Results are accumulated in memory and the built csv is committed once at the end (temp file + rename) '''
+    
+    
+    #dataTools.rotateImageDirectory(renderPath=renderPath)
+
+    if profile is not None:
+        profiler = instrumentation.profiler(os.path.dirname(jsonPath.rstrip('/')) + '/profile/', every=None, memory=profile.get('memory', True))
+        profiler.start(fileName + '_load')
+    else:
+        profiler = None
     
+    #a failed build still stops the profiler, tracemalloc keeps slowing the process down otherwise and the dumps of
+    # the phases that did run are written
+    try:
+        if gcpCsvPath is None: gcpCsvPath = gcpCsvName(csvPath)
+
+        #csv object, never written back so building twice gives the same output
+        data_csv = pd.read_csv(csvPath)
+
+        #csvs built in place by older versions already hold normalized boxes and gcp file names
+        if gcpPath and data_csv['fileName'].astype(str).str.startswith(gcpPath).any():
+            raise ValueError(f'{csvPath} already holds {gcpPath} file names, it was overwritten by an earlier build and cannot be rebuilt')
+
+        #.npy file or projection store that holds all projection matricies (output from blender)
+        #   vertexPath = None: bboxes were already reduced in the render loop (syntheticGen1 'stream' annotation)
+        #   and the csv holds pixel coordinates
+        if vertexPath is None:
+            vertMat = None
+        elif projectionStore.isStore(vertexPath):
+            vertMat = projectionStore.projectionReader(vertexPath)
+        else:
+            vertMat = np.load(vertexPath, allow_pickle=True)
+
+        classification = data_csv.loc[0, "classification"]
+
+
+        tempfileName = data_csv.loc[0, 'fileName']
+        print(tempfileName)
+
+        #get image resolutions from the render manifest, built from png headers if the generator did not write one
+        renderNames = [os.path.basename(str(name)) for name in pd.unique(data_csv['fileName'])]
+        manifest = renderManifest.loadManifest(renderManifest.manifestPath(renderPath, fileName))
+        lazyManifest = manifest is None
+        if lazyManifest:
+            manifest = renderManifest.buildManifest(renderPath, renderNames)
+
+        problems = renderManifest.checkManifest(manifest, renderNames)
+
+        #only keep a lazily built manifest if it is clean, a re-rendered frame must not be masked by a stale entry
+        if lazyManifest and not any(problems.values()):
+            renderManifest.writeManifest(renderManifest.manifestPath(renderPath, fileName), manifest)
+
+        for problem, frames in problems.items():
+            if frames: print(f'Warning: {problem} renders: {frames}')
+        if strictRenders and any(problems.values()):
+            raise ValueError(f'render check failed for {fileName}: {problems}')
+
+        resolutionX, resolutionY = renderManifest.resolution(manifest)
+
+        print(f'xRes: { resolutionX}, yRes: {resolutionY}')
+
+        if vertMat is not None:
+            numberOfImages = vertMat.shape[0]
+            numberOfObjects = vertMat.shape[1]
+        else:
+            numberOfObjects = int((data_csv['fileName'] == tempfileName).sum())
+            numberOfImages = len(data_csv) // numberOfObjects
+        print(numberOfImages)
+
+        #the split indexes images, a count that disagrees with the data would label missing images or leave some unlabeled
+        if renderCount is None: renderCount = numberOfImages
+        elif renderCount != numberOfImages:
+            raise ValueError(f'renderCount is {renderCount} but {fileName} holds {numberOfImages} images, pass renderCount=None to use the data')
+
+        #random index splits based on split requirements
+        train_index, test_index, validation_index = dataTools.splitData(renderCount, split)
+        print(f"train_index: {train_index}, test_index:{test_index}, validation_index:{validation_index}")
+
+        #list for storing json objects, will be converted to .jsonl
+        data_json_list = []
+
+        #streamed records skip the list entirely, a failed build closes the writer and removes its temp file
+        with (jsonlWriter(jsonPath + fileName + '.jsonl', compress=compressJsonl) if streamJsonl else contextlib.nullcontext()) as writer:
+            emit = writer.write if streamJsonl else data_json_list.append
+
+            if profiler:
+                profiler.stop()
+                profiler.start(fileName + '_build')
+
+            if engine == 'numpy':
+                labels = splitLabels(numberOfImages, train_index, test_index, validation_index)
+                for js in buildNumpy(data_csv, vertMat, numberOfImages, numberOfObjects, resolutionX, resolutionY, labels, gcpPath, fileName):
+                    emit(js)
+
+                if profiler:
+                    profiler.stop()
+                    profiler.start(fileName + '_write')
+
+                writeCsvAtomic(data_csv, gcpCsvPath)
+
+            else:
+                startImage = 0
+
+                #pick up an interrupted build, json records of finished images are rebuilt from the partial csv
+                if resume:
+                    partial_csv, startImage = loadCheckpoint(gcpCsvPath)
+                    if partial_csv is not None:
+                        data_csv = partial_csv
+                        print(f'resuming from image {startImage}')
+
+                        for i in range(startImage):
+                            rows = data_csv.iloc[i*numberOfObjects:(i + 1)*numberOfObjects]
+                            annotations = [boxAnnotation(row.classification, row.xMin, row.xMax, row.yMin, row.yMax) for row in rows.itertuples(index=False)]
+                            emit(jsonRecord(annotations, rows['use'].iloc[0], rows['fileName'].iloc[0]))
 
-    for i in range(numberOfImages): #this should be the number of images
+                for i in range(startImage, numberOfImages): #this should be the number of images
     
-        #data_csv.loc[i, 'fileName'] = gcpPath + fileName
-        numberOfObjects = np.shape(vertMat)[1]
+                    #data_csv.loc[i, 'fileName'] = gcpPath + fileName
+
+                    #every instance in the render goes into one jsonl record
+                    annotations = []
        
-        for j in range(numberOfObjects): #this should be the number of selected parts in each image
+                    for j in range(numberOfObjects): #this should be the number of selected parts in each image
             
-            #tempfileName = data_csv.loc[i*numberOfObjects + j, 'fileName']
-
-            #data_csv.loc[i*numberOfObjects + j, 'fileName'] = tempfileName
-            #sets for identifying max values
-            allX = set()
-            allY = set()
-
-            #extract image specific vertecies 
-            vertices = vertMat[i][j]
-
-            #build set for each dim
-            for k in range(len(vertices)):
-                x, y, _ = vertices[k]
-                allX.add(int(x))
-                allY.add(int(y))
-
-            #gather BBox coordinates
-            xMin = int(min(allX))
-            xMax = int(max(allX))
-            yMin = int(min(allY))
-            yMax = int(max(allY))
-            #print(f'i:{i}, j:{j},   xm: {xMin}, ym: {yMin}, xM:{xMax}, yM:{yMax}')
-
-            #Normalize them
-            xMin, xMax, yMin, yMax = dataTools.normalizeCoordinates(xMin, xMax, yMin, yMax, resolutionX, resolutionY)
-
-            #rotate by 180 (Specific for RCM):
-            xMaxHolder = copy.copy(xMax)
-            xMinHolder = copy.copy(xMin)
-            yMaxHolder = copy.copy(yMax)
-            yMinHolder = copy.copy(yMin)
-            #xMax = 1 - xMinHolder
-            #xMin = 1 - xMaxHolder
-            #yMax = 1 - yMinHolder
-            #yMin = 1 - yMaxHolder
-
-            #update csv
-            data_csv.loc[i*numberOfObjects + j, 'xMin'] = xMin
-            data_csv.loc[i*numberOfObjects + j, 'xMax'] = xMax
-            data_csv.loc[i*numberOfObjects + j, 'yMin'] = yMin
-            data_csv.loc[i*numberOfObjects + j, 'yMax'] = yMax
+                        #tempfileName = data_csv.loc[i*numberOfObjects + j, 'fileName']
+
+                        #data_csv.loc[i*numberOfObjects + j, 'fileName'] = tempfileName
+                        if vertMat is not None:
+                            #sets for identifying max values
+                            allX = set()
+                            allY = set()
+
+                            #extract image specific vertecies 
+                            vertices = vertMat[i][j]
+
+                            #build set for each dim
+                            for k in range(len(vertices)):
+                                x, y, _ = vertices[k]
+                                allX.add(int(x))
+                                allY.add(int(y))
+
+                            #gather BBox coordinates
+                            xMin = int(min(allX))
+                            xMax = int(max(allX))
+                            yMin = int(min(allY))
+                            yMax = int(max(allY))
+
+                        else:
+                            #pixel bbox streamed from the render loop
+                            xMin = int(data_csv.loc[i*numberOfObjects + j, 'xMin'])
+                            xMax = int(data_csv.loc[i*numberOfObjects + j, 'xMax'])
+                            yMin = int(data_csv.loc[i*numberOfObjects + j, 'yMin'])
+                            yMax = int(data_csv.loc[i*numberOfObjects + j, 'yMax'])
+
+                        #print(f'i:{i}, j:{j},   xm: {xMin}, ym: {yMin}, xM:{xMax}, yM:{yMax}')
+
+                        #Normalize them
+                        xMin, xMax, yMin, yMax = dataTools.normalizeCoordinates(xMin, xMax, yMin, yMax, resolutionX, resolutionY)
+
+                        #rotate by 180 (Specific for RCM):
+                        xMaxHolder = copy.copy(xMax)
+                        xMinHolder = copy.copy(xMin)
+                        yMaxHolder = copy.copy(yMax)
+                        yMinHolder = copy.copy(yMin)
+                        #xMax = 1 - xMinHolder
+                        #xMin = 1 - xMaxHolder
+                        #yMax = 1 - yMinHolder
+                        #yMin = 1 - yMaxHolder
+
+                        #update csv
+                        data_csv.loc[i*numberOfObjects + j, 'xMin'] = xMin
+                        data_csv.loc[i*numberOfObjects + j, 'xMax'] = xMax
+                        data_csv.loc[i*numberOfObjects + j, 'yMin'] = yMin
+                        data_csv.loc[i*numberOfObjects + j, 'yMax'] = yMax
 
             
             
 
-            #dataTools.renameImage(renderPath + str(i) + fileName + '.png', renderPath + str(i) + fileName + data_csv.loc[i, 'classification'] + '.png')
+                        #dataTools.renameImage(renderPath + str(i) + fileName + '.png', renderPath + str(i) + fileName + data_csv.loc[i, 'classification'] + '.png')
             
 
             
-            #vertex AI GCP stuff:
-            displayName = data_csv.loc[i*numberOfObjects + j, "classification"]
-            print(f'i*numObjects + j: {i*numberOfObjects + j}')
-            
-            '''
-            Format from GCP intro page:
-
-                j = {"imageGcsUri":"gs://bucket/filename.ext",
-                    "classificationAnnotation": {"displayName": "LABEL",
-                                                "annotationResourceLabels": {"aiplatform.googleapis.com/annotation_set_name": "displayName",
-                                                                            "env": "prod"
-                                                                            }
-                                                },
-                    "dataItemResourceLabels": {"aiplatform.googleapis.com/ml_use": "training/test/validation"}
-                    }'''
-            
-            annotationResourceLabels = dict({"airplatform.googleapis.com/annotation_set_name":"7787165759397953536"})
-            if i in train_index: TTV ="train"
-            elif i in test_index: TTV ="test"
-            elif i in validation_index: TTV ="validation"
-
-            dataItemResourceLabels = dict({"airplatform.googleapis.com/ml_use":TTV})
-            boundingBoxAnnotations = [dict({"displayName":displayName,
-                                            "xMin":xMin,
-                                            "xMax":xMax,
-                                            "yMin":yMin,
-                                            "yMax":yMax,
-                                            "annotationResourceLabels":annotationResourceLabels})]
+                        #vertex AI GCP stuff:
+                        displayName = data_csv.loc[i*numberOfObjects + j, "classification"]
+                        print(f'i*numObjects + j: {i*numberOfObjects + j}')
             
-            js = {"imageGcsUri":gcpPath+fileName+".png",
-                "boundingBoxAnnotations":boundingBoxAnnotations,
-                "dataItemResourceLabels":dataItemResourceLabels}
+                        '''
+                        Format from GCP intro page:
+
+                            j = {"imageGcsUri":"gs://bucket/filename.ext",
+                                "classificationAnnotation": {"displayName": "LABEL",
+                                                            "annotationResourceLabels": {"aiplatform.googleapis.com/annotation_set_name": "displayName",
+                                                                                        "env": "prod"
+                                                                                        }
+                                                            },
+                                "dataItemResourceLabels": {"aiplatform.googleapis.com/ml_use": "training/test/validation"}
+                                }'''
             
-            data_json_list.append(js)
+                        if i in train_index: TTV ="train"
+                        elif i in test_index: TTV ="test"
+                        elif i in validation_index: TTV ="validation"
 
+                        annotations.append(boxAnnotation(displayName, xMin, xMax, yMin, yMax))
 
-            data_csv.loc[i*numberOfObjects + j, 'use'] = TTV
 
-            tempFileName = str(data_csv.loc[i*numberOfObjects + j, 'fileName'])
+                        data_csv.loc[i*numberOfObjects + j, 'use'] = TTV
 
-            data_csv.loc[i*numberOfObjects + j, 'fileName'] = gcpPath + tempFileName
+                        tempFileName = str(data_csv.loc[i*numberOfObjects + j, 'fileName'])
 
-            data_csv.to_csv(csvPath, index=False)
-    
-    dataTools.Json2Jsonl(data_json_list, fileName,outPath=jsonPath)
+                        data_csv.loc[i*numberOfObjects + j, 'fileName'] = gcpPath + tempFileName
+
+                    js = jsonRecord(annotations, TTV, data_csv.loc[i*numberOfObjects, 'fileName'])
+                    emit(js)
+
+                    if checkpoint and (i + 1) % checkpoint == 0:
+                        writeCheckpoint(data_csv, gcpCsvPath, i + 1)
+
+                if profiler:
+                    profiler.stop()
+                    profiler.start(fileName + '_write')
+
+                #single commit of the finished csv
+                writeCsvAtomic(data_csv, gcpCsvPath)
+                clearCheckpoint(gcpCsvPath)
+
+        if not streamJsonl: dataTools.Json2Jsonl(data_json_list, fileName,outPath=jsonPath)
+
+    finally:
+        if profiler:
+            for path in profiler.stop(): print(f'profile: {path}')
     
     
     
@@ -171,13 +510,13 @@ if __name__ == "__main__":
     renderPath = rootDir + fileName + "/renders/"
     csvPath = rootDir + fileName + "/csvFile/" + fileName + ".csv"
     jsonPath = rootDir + fileName + "/jsonFile/"
-    vertexPath = rootDir + fileName + "/projectionMat/" + fileName + ".npy"
+    vertexPath = rootDir + fileName + "/projectionMat/" + fileName + ".npy"     #.npy or projection store base path, None if the csv already holds streamed bboxes
     gcpPath = "gs://metapix-advmfg-bucket-d/mtdc_fvis_synthetic/training_datasets/ADAS/trial1/"
 
     #data splits
     split = [0.80, 0.0, 0.2] #[Train, test, validation] ***sum(split) = 1***
 
-    renderCount = 20
+    renderCount = None     # [<None>, <int>]     None counts the images in the projection data / csv, an int must match it
 
     main(fileName =         fileName,
          renderCount=       renderCount, 
@@ -187,5 +526,12 @@ if __name__ == "__main__":
          csvPath=           csvPath, 
          jsonPath=          jsonPath, 
          gcpPath=           gcpPath, 
-         split =            split)
+         split =            split,
+         engine =           'numpy',       # [<'numpy'>, <'loop'>]
+         checkpoint =       None,          # [<None>, <int>]             loop engine: save progress every n images
+         resume =           False,         # [<True>, <False>]           loop engine: continue from last checkpoint
+         streamJsonl =      True,          # [<True>, <False>]           write jsonl records as they are computed
+         compressJsonl =    False,         # [<True>, <False>]           gzip streamed jsonl
+         strictRenders =    False,         # [<True>, <False>]           fail on missing/truncated renders instead of warning
+         profile =          None)          # [<None>, <{'memory': bool}>] cProfile/tracemalloc dumps of load, build and write phases
     
\ No newline at end of file
@@ -0,0 +1,158 @@
+import numpy as np
+import json
+import os
+
+#flat import next to buildDataSet5 / renderShards, package import as utils.<module> inside blender
+try: import appendStore
+except ImportError: from . import appendStore
+
+
+'''Append only store for per frame scene descriptions, replaces one descriptionJson/<i><fileName>.json per frame
+
+        <base>.jsonl        one compact json record per frame, in frame order
+        <base>.idx          (frames + 1,) int64 byte offsets, record i = bytes [idx[i], idx[i+1]) of the jsonl
+
+    The offset of a record is appended only after the record itself is on disk (see appendStore).
+'''
+
+
+EXTENSIONS = ['.jsonl', '.idx']
+
+
+def basePath(path):
+
+    ''' strips store extensions, accepts either the base path or any of the store files '''
+
+    return appendStore.basePath(path, EXTENSIONS)
+
+def isStore(path):
+
+    ''' returns True if path points to a description store '''
+
+    return appendStore.isStore(path, EXTENSIONS, '.idx')
+
+
+class descriptionWriter(appendStore.appendWriter):
+
+    ''' appends one description record per frame
+
+        PARAMS:
+            path:           base path, eg. paths['descriptionJson'] + paths['fileName']
+            resumeFrames:   <int>   reopen an existing store, keep its first resumeFrames records and drop the rest,
+                                    0 on a missing store starts a fresh one '''
+
+    def __init__(self, path, resumeFrames=None):
+
+        self.path = basePath(path)
+
+        resumeFrames = appendStore.checkResume(self.path, resumeFrames, isStore(self.path), 'description')
+        if resumeFrames is not None:
+            self.reopen(resumeFrames)
+            return
+
+        self.recordFile, self.indexFile = self.openFiles(EXTENSIONS)
+
+        self.frames = 0
+        self.offset = 0
+        np.zeros(1, dtype=np.int64).tofile(self.indexFile)
+
+    def reopen(self, frames):
+
+        ''' truncate an existing store to its first frames records and continue appending after them '''
+
+        reader = descriptionReader(self.path)
+        if reader.frames < frames:
+            raise ValueError(f'{self.path} holds {reader.frames} records, cannot resume at frame {frames}')
+
+        self.frames = frames
+        self.offset = int(reader.offsets[frames])
+
+        self.recordFile, self.indexFile = self.openFiles(EXTENSIONS, [self.offset, (frames + 1)*8])
+
+    def append(self, record):
+
+        ''' add the record of the next frame, any json serializable dict '''
+
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+        #record must be on disk before the offset that points past it
+        self.recordFile.write(line)
+        self.recordFile.flush()
+
+        self.offset += len(line)
+        np.array([self.offset], dtype=np.int64).tofile(self.indexFile)
+        self.indexFile.flush()
+
+        self.frames += 1
+
+
+class descriptionReader():
+
+    ''' random access to description records, reader[i] returns the dict of frame i, only that record is read '''
+
+    def __init__(self, path):
+
+        self.path = basePath(path)
+
+        offsets = np.fromfile(self.path + '.idx', dtype=np.int64)
+
+        #ignore a record whose offset made it to disk but whose bytes did not
+        size = os.path.getsize(self.path + '.jsonl')
+        self.frames = int(np.searchsorted(offsets, size, side='right')) - 1
+        self.offsets = offsets[:self.frames + 1]
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, frame):
+        return self.record(frame)
+
+    def __iter__(self):
+
+        ''' yields records in frame order with one sequential read '''
+
+        with open(self.path + '.jsonl', 'rb') as file:
+            for _ in range(self.frames):
+                yield json.loads(file.readline())
+
+    def record(self, frame):
+
+        ''' returns the description dict of a single frame '''
+
+        if frame < 0: frame += self.frames
+        if not 0 <= frame < self.frames:
+            raise IndexError(f'frame {frame} out of range, store holds {self.frames} frames')
+
+        start, stop = int(self.offsets[frame]), int(self.offsets[frame + 1])
+        with open(self.path + '.jsonl', 'rb') as file:
+            file.seek(start)
+            return json.loads(file.read(stop - start))
+
+
+def convertJsonDir(descriptionDir, fileName, path=None):
+
+    ''' collect per frame descriptionJson/<i><fileName>.json files of older syntheticGen1 runs into a store,
+        stops at the first missing frame, returns the store base path '''
+
+    if path is None: path = descriptionDir + fileName
+
+    writer = descriptionWriter(path)
+
+    frame = 0
+    while os.path.exists(descriptionDir + str(frame) + fileName + '.json'):
+        with open(descriptionDir + str(frame) + fileName + '.json', 'r') as file:
+            writer.append(json.load(file))
+        frame += 1
+
+    writer.close()
+
+    return writer.path
+
+
+if __name__ == "__main__":
+
+    fileName = "synthGenT3"
+
+    rootDir = "/home/tuna/Documents/driving/Vision/syntheticData/dataSets/ADAS/"
+
+    convertJsonDir(rootDir + fileName + "/descriptionJson/", fileName)
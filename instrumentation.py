@@ -0,0 +1,229 @@
+import numpy as np
+import collections
+import cProfile
+import tracemalloc
+import json
+import time
+import sys
+import os
+
+
+'''Per phase timing of the syntheticGen1 render loop
+
+    The loop calls timer.start(frame) once per frame and timer.lap(phase) after each phase, laps with the same phase
+    name in one frame add up. end() closes the frame, updates rolling statistics and appends one line to the timings file:
+
+        {"frame": 12, "total": 14.2, "phases": {"poseApply": 0.01, "materials": 0.002, "lights": 0.001, "projection": 0.3, ...}}
+
+    Aggregate a finished (or running) run with:
+
+        python instrumentation.py <root><fileName>_timings.jsonl
+
+    profiler wraps sampled frames or whole phases in cProfile (and optionally tracemalloc) for runs that are slow
+    for no obvious reason, read the dumps with pstats / snakeviz and tracemalloc.Snapshot.load.
+'''
+
+
+class frameTimer():
+
+    ''' rolling per phase statistics of a long loop
+
+        PARAMS:
+            path:       timings jsonl, None keeps statistics in memory only
+            alpha:      <float> EWMA weight of the newest frame
+            window:     <int>   frames kept for p50/p95
+            append:     <bool>  continue an existing timings file (resumed runs) '''
+
+    def __init__(self, path=None, alpha=0.1, window=200, append=False):
+
+        self.alpha = alpha
+        self.window = window
+
+        self.ewma = dict()          #phase -> seconds, 'total' for the whole frame
+        self.history = dict()       #phase -> deque of the last window frames
+        self.frames = 0
+
+        self.frame = None
+        self.phases = None
+        self.frameStart = None
+        self.lapStart = None
+
+        self.file = open(path, 'a' if append else 'w') if path else None
+
+    def start(self, frame):
+
+        self.frame = frame
+        self.phases = dict()
+        self.frameStart = self.lapStart = time.perf_counter()
+
+    def lap(self, phase):
+
+        ''' time since the previous lap (or start) is added to phase '''
+
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.) + now - self.lapStart
+        self.lapStart = now
+
+    def end(self):
+
+        ''' close the frame, returns its total seconds '''
+
+        total = time.perf_counter() - self.frameStart
+        self.phases['other'] = self.phases.get('other', 0.) + total - sum(self.phases.values())
+
+        for phase, seconds in list(self.phases.items()) + [('total', total)]:
+            if phase not in self.ewma:
+                self.ewma[phase] = seconds
+                self.history[phase] = collections.deque(maxlen=self.window)
+            else:
+                self.ewma[phase] += self.alpha*(seconds - self.ewma[phase])
+            self.history[phase].append(seconds)
+
+        self.frames += 1
+
+        if self.file:
+            self.file.write(json.dumps({'frame': self.frame, 'total': total, 'phases': self.phases}) + '\n')
+            self.file.flush()
+
+        return total
+
+    def percentile(self, phase, q):
+
+        return float(np.percentile(self.history[phase], q)) if phase in self.history else 0.
+
+    def eta(self, remainingFrames):
+
+        ''' seconds left, EWMA of frame time times remaining frames '''
+
+        return self.ewma.get('total', 0.) * remainingFrames
+
+    def status(self, phases=3):
+
+        ''' one line with the slowest phases, 'render 12.10s (p50 12.00, p95 13.40) | ...' '''
+
+        slowest = sorted((phase for phase in self.ewma if phase != 'total'), key=lambda phase: -self.ewma[phase])[:phases]
+
+        return ' | '.join(f'{phase} {self.ewma[phase]:.2f}s (p50 {self.percentile(phase, 50):.2f}, p95 {self.percentile(phase, 95):.2f})'
+                          for phase in slowest)
+
+    def close(self):
+        if self.file: self.file.close()
+
+
+class profiler():
+
+    ''' cProfile + tracemalloc around selected frames or phases, writes <directory><name>.prof and <name>.snap
+
+        PARAMS:
+            directory:  output folder, created if missing
+            every:      <int>   due(i) is True for every every'th index, bounds the overhead on production runs
+            frames:     <list>  indices always profiled, eg. [0, 1] to catch first frame setup
+            memory:     <bool>  also snapshot allocations, tracing makes python code several times slower while active '''
+
+    def __init__(self, directory, every=100, frames=None, memory=True):
+
+        self.directory = directory.rstrip('/') + '/'
+        self.every = every
+        self.frames = set(frames or [])
+        self.memory = memory
+
+        self.profile = None
+        self.name = None
+        self.tracing = False
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def due(self, index):
+
+        return index in self.frames or (bool(self.every) and index % self.every == 0)
+
+    def start(self, name):
+
+        ''' begin profiling, ignored while a profile is already running '''
+
+        if self.profile is not None:
+            return
+
+        self.name = name
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+
+        ''' end profiling and write the dumps, returns list of written paths (empty if nothing was running) '''
+
+        if self.profile is None:
+            return []
+
+        self.profile.disable()
+        paths = [self.directory + self.name + '.prof']
+        self.profile.dump_stats(paths[0])
+        self.profile = None
+
+        if self.memory and tracemalloc.is_tracing():
+            paths.append(self.directory + self.name + '.snap')
+            tracemalloc.take_snapshot().dump(paths[1])
+            if self.tracing:
+                tracemalloc.stop()
+                self.tracing = False
+
+        return paths
+
+
+def loadTimings(path):
+
+    ''' returns list of frame records, a line cut short by a crash is skipped '''
+
+    records = []
+    with open(path, 'r') as file:
+        for line in file:
+            try: records.append(json.loads(line))
+            except json.JSONDecodeError: continue
+
+    return records
+
+def summary(path):
+
+    ''' per phase count, mean, p50, p95, max and share of total time of a timings file, returns dict phase -> stats '''
+
+    records = loadTimings(path)
+
+    samples = collections.defaultdict(list)
+    for record in records:
+        samples['total'].append(record['total'])
+        for phase, seconds in record['phases'].items():
+            samples[phase].append(seconds)
+
+    grandTotal = sum(samples['total'])
+
+    stats = dict()
+    for phase, values in samples.items():
+        values = np.asarray(values)
+        stats[phase] = {'count':    len(values),
+                        'mean':     float(values.mean()),
+                        'p50':      float(np.percentile(values, 50)),
+                        'p95':      float(np.percentile(values, 95)),
+                        'max':      float(values.max()),
+                        'share':    float(values.sum()/grandTotal) if grandTotal else 0.}
+
+    return stats
+
+def printSummary(path):
+
+    stats = summary(path)
+
+    print(f"{'phase':<14}{'frames':>8}{'mean s':>10}{'p50 s':>10}{'p95 s':>10}{'max s':>10}{'share':>8}")
+    for phase in sorted(stats, key=lambda phase: (phase == 'total', -stats[phase]['share'])):
+        s = stats[phase]
+        print(f"{phase:<14}{s['count']:>8}{s['mean']:>10.3f}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['max']:>10.3f}{s['share']:>8.1%}")
+
+
+if __name__ == "__main__":
+
+    for path in sys.argv[1:]:
+        print(path)
+        printSummary(path)
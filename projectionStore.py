@@ -0,0 +1,278 @@
+import numpy as np
+import json
+
+#flat import next to buildDataSet5 / renderShards, package import as utils.<module> inside blender
+try: import appendStore
+except ImportError: from . import appendStore
+
+
+'''Fixed width projection storage, replaces the ragged pickled .npy written by syntheticGen1
+
+    Vertices of every object in every frame are stored back to back in flat buffers, an offset array marks
+    where each (frame, object) block starts (CSR style). Readers open the buffers with np.memmap so a single
+    frame or object can be sliced without loading the rest.
+
+        <base>.proj.json        header: objectsPerFrame, quantized, dtypes
+        <base>.xy.bin           (M, 2) pixel coordinates        float32, or int16 when quantized
+        <base>.depth.bin        (M,)   depth to camera          float32, or float16 when quantized
+        <base>.offsets.bin      (frames*objectsPerFrame + 1,)   int64 vertex offsets, block k = [offsets[k], offsets[k+1])
+
+    Offsets are appended only after the vertex data of a frame is on disk (see appendStore).
+'''
+
+
+EXTENSIONS = ['.proj.json', '.xy.bin', '.depth.bin', '.offsets.bin']
+
+
+def basePath(path):
+
+    ''' strips store extensions, accepts either the base path or any of the store files '''
+
+    return appendStore.basePath(path, EXTENSIONS)
+
+def isStore(path):
+
+    ''' returns True if path points to a projection store instead of a .npy file '''
+
+    return appendStore.isStore(path, EXTENSIONS, '.proj.json')
+
+
+class projectionWriter(appendStore.appendWriter):
+
+    ''' appends projected vertices frame by frame
+
+        PARAMS:
+            path:               base path, eg. paths['projectionMat'] + paths['fileName']
+            objectsPerFrame:    <int>   number of projected objects in every frame
+            quantize:           <bool>  store int16 pixels and float16 depth (half the size of float32)
+            resumeFrames:       <int>   reopen an existing store, keep its first resumeFrames frames and drop the rest,
+                                        0 on a missing store starts a fresh one '''
+
+    def __init__(self, path, objectsPerFrame, quantize=False, resumeFrames=None):
+
+        self.path = basePath(path)
+        self.objectsPerFrame = objectsPerFrame
+        self.quantize = quantize
+        self.frames = 0
+
+        resumeFrames = appendStore.checkResume(self.path, resumeFrames, isStore(self.path), 'projection')
+        if resumeFrames is not None:
+            self.reopen(resumeFrames)
+            return
+
+        if quantize: self.xyType, self.depthType = np.int16, np.float16
+        else: self.xyType, self.depthType = np.float32, np.float32
+
+        header = {'objectsPerFrame':   objectsPerFrame,
+                  'quantized':         quantize,
+                  'xyType':            np.dtype(self.xyType).name,
+                  'depthType':         np.dtype(self.depthType).name}
+
+        with open(self.path + '.proj.json', 'w') as file:
+            json.dump(header, file)
+
+        self.xyFile, self.depthFile, self.offsetFile = self.openFiles(EXTENSIONS[1:])
+
+        self.count = 0
+        np.zeros(1, dtype=np.int64).tofile(self.offsetFile)
+
+    def reopen(self, frames):
+
+        ''' truncate an existing store to its first frames frames and continue appending after them '''
+
+        reader = projectionReader(self.path)
+        if reader.frames < frames:
+            raise ValueError(f'{self.path} holds {reader.frames} frames, cannot resume at frame {frames}')
+        if (reader.objectsPerFrame, reader.quantized) != (self.objectsPerFrame, self.quantize):
+            raise ValueError(f'{self.path} layout does not match, cannot resume')
+
+        self.xyType, self.depthType = reader.xy.dtype.type, reader.depth.dtype.type
+        self.count = int(reader.offsets[frames*self.objectsPerFrame])
+        self.frames = frames
+        del reader
+
+        sizes = [self.count*2*np.dtype(self.xyType).itemsize, self.count*np.dtype(self.depthType).itemsize, (frames*self.objectsPerFrame + 1)*8]
+        self.xyFile, self.depthFile, self.offsetFile = self.openFiles(EXTENSIONS[1:], sizes)
+
+    def append(self, frameCoordinates):
+
+        ''' add one frame, frameCoordinates = [[[x, y, depth], ...] for each object] '''
+
+        if len(frameCoordinates) != self.objectsPerFrame:
+            raise ValueError(f'expected {self.objectsPerFrame} objects per frame, got {len(frameCoordinates)}')
+
+        offsets = []
+        for coordinates in frameCoordinates:
+            vertices = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+
+            xy = vertices[:, :2]
+            if self.quantize:
+                info = np.iinfo(np.int16)
+                xy = np.clip(np.trunc(xy), info.min, info.max)
+
+            xy.astype(self.xyType).tofile(self.xyFile)
+            vertices[:, 2].astype(self.depthType).tofile(self.depthFile)
+
+            self.count += len(vertices)
+            offsets.append(self.count)
+
+        #vertex data must be on disk before the offsets that point to it
+        self.xyFile.flush()
+        self.depthFile.flush()
+        np.asarray(offsets, dtype=np.int64).tofile(self.offsetFile)
+        self.offsetFile.flush()
+
+        self.frames += 1
+
+
+class projectionReader():
+
+    ''' memory mapped access to a projection store, reader[i][j] returns the (n, 3) [x, y, depth] array of
+        object j in frame i like the old .npy object array '''
+
+    def __init__(self, path):
+
+        self.path = basePath(path)
+
+        with open(self.path + '.proj.json', 'r') as file:
+            header = json.load(file)
+
+        self.objectsPerFrame = header['objectsPerFrame']
+        self.quantized = header['quantized']
+
+        offsets = np.fromfile(self.path + '.offsets.bin', dtype=np.int64)
+
+        #ignore a partially written frame at the end
+        self.frames = (len(offsets) - 1) // self.objectsPerFrame
+        self.offsets = offsets[:self.frames*self.objectsPerFrame + 1]
+        self.shape = (self.frames, self.objectsPerFrame)
+
+        count = int(self.offsets[-1])
+        self.xy = self.memmap(self.path + '.xy.bin', np.dtype(header['xyType']), (count, 2))
+        self.depth = self.memmap(self.path + '.depth.bin', np.dtype(header['depthType']), (count,))
+
+    @staticmethod
+    def memmap(path, dtype, shape):
+
+        ''' np.memmap refuses empty files '''
+
+        if shape[0] == 0: return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, frame):
+        return self.frame(frame)
+
+    def block(self, frame, obj):
+
+        ''' returns [start, stop) vertex range of object obj in frame '''
+
+        if not 0 <= frame < self.frames:
+            raise IndexError(f'frame {frame} out of range, store holds {self.frames} frames')
+
+        k = frame*self.objectsPerFrame + obj
+        return int(self.offsets[k]), int(self.offsets[k + 1])
+
+    def object(self, frame, obj):
+
+        ''' returns (n, 3) float array of [x, y, depth] for a single object in a single frame '''
+
+        start, stop = self.block(frame, obj)
+
+        vertices = np.empty((stop - start, 3), dtype=np.float64)
+        vertices[:, :2] = self.xy[start:stop]
+        vertices[:, 2] = self.depth[start:stop]
+
+        return vertices
+
+    def frame(self, frame):
+
+        ''' returns list of (n, 3) arrays, one per object '''
+
+        return [self.object(frame, obj) for obj in range(self.objectsPerFrame)]
+
+    def boxes(self):
+
+        ''' returns (frames, objectsPerFrame, 4) pixel bboxes [xMin, xMax, yMin, yMax], int truncated like
+            buildDataSet5, computed in one pass with reduceat (every object must have at least one vertex) '''
+
+        if self.frames == 0:
+            return np.zeros((0, self.objectsPerFrame, 4))
+
+        starts = self.offsets[:-1]
+        pixels = np.trunc(np.asarray(self.xy, dtype=np.float64))
+
+        mins = np.minimum.reduceat(pixels, starts, axis=0)
+        maxs = np.maximum.reduceat(pixels, starts, axis=0)
+
+        boxes = np.stack([mins[:, 0], maxs[:, 0], mins[:, 1], maxs[:, 1]], axis=-1)
+
+        return boxes.reshape(self.frames, self.objectsPerFrame, 4)
+
+
+def saveNpy(frames, npyPath):
+
+    ''' save per frame lists of per object vertex arrays as the ragged .npy older syntheticGen1 runs wrote, an object
+        array of shape (frames, objectsPerFrame). numpy >= 1.24 refuses to build one from a ragged list by itself '''
+
+    vertMat = np.empty((len(frames), len(frames[0]) if len(frames) else 0), dtype=object)
+    for i, frameCoordinates in enumerate(frames):
+        for j, coordinates in enumerate(frameCoordinates):
+            vertMat[i, j] = coordinates
+
+    np.save(npyPath, vertMat, allow_pickle=True)
+
+def convertNpy(npyPath, path=None, quantize=False):
+
+    ''' convert a ragged .npy saved by older syntheticGen1 runs into a projection store next to it,
+        returns the store base path '''
+
+    vertMat = np.load(npyPath, allow_pickle=True)
+
+    if path is None: path = npyPath[:-len('.npy')] if npyPath.endswith('.npy') else npyPath
+
+    writer = projectionWriter(path, objectsPerFrame=np.shape(vertMat)[1], quantize=quantize)
+    for frameCoordinates in vertMat:
+        writer.append(frameCoordinates)
+    writer.close()
+
+    return writer.path
+
+
+def mergeStores(paths, path):
+
+    ''' concatenate projection stores frame wise (eg. render shards) into a new store at path, returns frame count '''
+
+    readers = [projectionReader(storePath) for storePath in paths]
+
+    objectsPerFrame = readers[0].objectsPerFrame
+    quantize = readers[0].quantized
+    for reader in readers:
+        if (reader.objectsPerFrame, reader.quantized) != (objectsPerFrame, quantize):
+            raise ValueError(f'{reader.path} does not match {readers[0].path}, cannot merge')
+
+    writer = projectionWriter(path, objectsPerFrame=objectsPerFrame, quantize=quantize)
+
+    for reader in readers:
+        np.asarray(reader.xy).tofile(writer.xyFile)
+        np.asarray(reader.depth).tofile(writer.depthFile)
+        (reader.offsets[1:] + writer.count).tofile(writer.offsetFile)
+
+        writer.count += int(reader.offsets[-1])
+        writer.frames += reader.frames
+
+    writer.close()
+
+    return writer.frames
+
+
+if __name__ == "__main__":
+
+    fileName = "synthGenT3"
+
+    rootDir = "/home/tuna/Documents/driving/Vision/syntheticData/dataSets/ADAS/"
+    vertexPath = rootDir + fileName + "/projectionMat/" + fileName + ".npy"
+
+    convertNpy(vertexPath, quantize=False)
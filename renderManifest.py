@@ -0,0 +1,265 @@
+import os
+import json
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+'''Render manifest: one json line per rendered frame
+
+        {"frame": 0, "fileName": "0<fileName>.png", "resolutionX": 760, "resolutionY": 556, "bytes": 412345, "checksum": "1a2b3c4d", "complete": true}
+
+    Written by syntheticGen1 as frames are saved, or built lazily from the PNG/JPEG/WebP headers. buildDataSet5 uses it
+    to learn the resolution and detect missing or truncated renders without decoding any image.
+'''
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_IEND = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+
+
+def manifestPath(renderPath, fileName):
+
+    ''' default manifest location, renders/<fileName>_manifest.jsonl '''
+
+    return renderPath + fileName + '_manifest.jsonl'
+
+def readPngHeader(path):
+
+    ''' returns (width, height) from the PNG IHDR chunk, only the first 24 bytes are read '''
+
+    with open(path, 'rb') as file:
+        head = file.read(24)
+
+    if len(head) < 24 or head[:8] != PNG_SIGNATURE or head[12:16] != b'IHDR':
+        raise ValueError(f'{path} is not a png')
+
+    return struct.unpack('>II', head[16:24])
+
+def readJpegHeader(path):
+
+    ''' returns (width, height) from the first JPEG start of frame segment, walks segment headers only '''
+
+    with open(path, 'rb') as file:
+        if file.read(2) != JPEG_SOI:
+            raise ValueError(f'{path} is not a jpeg')
+
+        while True:
+            marker = file.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                raise ValueError(f'{path} has no jpeg frame header')
+
+            #start of frame markers, except DHT (c4), JPG (c8) and DAC (cc)
+            if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+                segment = file.read(7)
+                if len(segment) < 7: raise ValueError(f'{path} has no jpeg frame header')
+                height, width = struct.unpack('>HH', segment[3:7])
+                return width, height
+
+            length = file.read(2)
+            if len(length) < 2: raise ValueError(f'{path} has no jpeg frame header')
+            file.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+
+def readWebpHeader(path):
+
+    ''' returns (width, height) from the first WebP chunk (VP8, VP8L or VP8X) '''
+
+    with open(path, 'rb') as file:
+        head = file.read(30)
+
+    if len(head) < 30 or head[:4] != b'RIFF' or head[8:12] != b'WEBP':
+        raise ValueError(f'{path} is not a webp')
+
+    chunk = head[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L':
+        bits = struct.unpack('<I', head[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X':
+        return int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+
+    raise ValueError(f'{path} has an unknown webp chunk {chunk}')
+
+def imageType(path):
+
+    ''' 'png', 'jpeg' or 'webp' from the file signature, None for anything else '''
+
+    with open(path, 'rb') as file:
+        head = file.read(12)
+
+    if head[:8] == PNG_SIGNATURE: return 'png'
+    if head[:2] == JPEG_SOI: return 'jpeg'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP': return 'webp'
+
+    return None
+
+def readImageHeader(path):
+
+    ''' returns (width, height) of a png, jpeg or webp render '''
+
+    kind = imageType(path)
+    if kind == 'png': return readPngHeader(path)
+    if kind == 'jpeg': return readJpegHeader(path)
+    if kind == 'webp': return readWebpHeader(path)
+
+    raise ValueError(f'{path} is not a png, jpeg or webp')
+
+def isComplete(path):
+
+    ''' cheap truncation check: a finished PNG ends with the IEND chunk, a JPEG with the EOI marker and a WebP is as
+        long as its RIFF header says '''
+
+    kind = imageType(path)
+
+    with open(path, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+
+        if kind == 'png':
+            if size < len(PNG_SIGNATURE) + len(PNG_IEND):
+                return False
+            file.seek(-len(PNG_IEND), os.SEEK_END)
+            return file.read() == PNG_IEND
+
+        if kind == 'jpeg':
+            file.seek(-len(JPEG_EOI), os.SEEK_END)
+            return file.read() == JPEG_EOI
+
+        if kind == 'webp':
+            file.seek(4)
+            return struct.unpack('<I', file.read(4))[0] + 8 == size
+
+    return False
+
+def fileChecksum(path, chunkSize=1 << 20):
+
+    ''' crc32 of the whole file as hex string '''
+
+    crc = 0
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunkSize), b''):
+            crc = zlib.crc32(chunk, crc)
+
+    return f'{crc:08x}'
+
+def manifestEntry(path, frame, checksum=True):
+
+    ''' build manifest record for a single render, missing files are recorded with bytes = None '''
+
+    entry = {'frame':       frame,
+             'fileName':    os.path.basename(path),
+             'resolutionX': None,
+             'resolutionY': None,
+             'bytes':       None,
+             'checksum':    None,
+             'complete':    False}
+
+    if not os.path.exists(path):
+        return entry
+
+    entry['bytes'] = os.path.getsize(path)
+
+    try:
+        entry['resolutionX'], entry['resolutionY'] = readImageHeader(path)
+        entry['complete'] = isComplete(path)
+    except ValueError:
+        return entry
+
+    if checksum:
+        entry['checksum'] = fileChecksum(path)
+
+    return entry
+
+def buildManifest(renderPath, fileNames, checksum=False, workers=8):
+
+    ''' read headers of every render in parallel, fileNames ordered by frame index '''
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries = pool.map(lambda item: manifestEntry(renderPath + item[1], item[0], checksum=checksum), enumerate(fileNames))
+        return list(entries)
+
+def writeManifest(path, entries):
+
+    with open(path + '.tmp', 'w') as file:
+        for entry in entries:
+            file.write(json.dumps(entry) + '\n')
+    os.replace(path + '.tmp', path)
+
+def loadManifest(path):
+
+    ''' returns list of entries sorted by frame, or None if there is no manifest '''
+
+    if not os.path.exists(path):
+        return None
+
+    entries = dict()
+    with open(path, 'r') as file:
+        for line in file:
+            #last line may be cut short if the generator died mid write
+            try: entry = json.loads(line)
+            except json.JSONDecodeError: continue
+            entries[entry['frame']] = entry     #later records win, a re-rendered frame overrides the old one
+
+    return [entries[frame] for frame in sorted(entries.keys())]
+
+def checkManifest(entries, fileNames=None):
+
+    ''' returns dict of problems: 'missing' frames, 'truncated' frames, frames whose resolution differs from frame 0
+        and files listed in fileNames that have no manifest entry '''
+
+    problems = {'missing': [], 'truncated': [], 'resolution': [], 'unlisted': []}
+
+    resolution = None
+    for entry in entries:
+        if entry['bytes'] is None:
+            problems['missing'].append(entry['frame'])
+        elif not entry['complete']:
+            problems['truncated'].append(entry['frame'])
+        elif resolution is None:
+            resolution = (entry['resolutionX'], entry['resolutionY'])
+        elif resolution != (entry['resolutionX'], entry['resolutionY']):
+            problems['resolution'].append(entry['frame'])
+
+    if fileNames is not None:
+        listed = set(entry['fileName'] for entry in entries)
+        problems['unlisted'] = [name for name in fileNames if name not in listed]
+
+    return problems
+
+def resolution(entries):
+
+    ''' returns (resolutionX, resolutionY) of the first complete render '''
+
+    for entry in entries:
+        if entry['complete']:
+            return entry['resolutionX'], entry['resolutionY']
+
+    raise ValueError('manifest has no complete renders')
+
+
+class manifestWriter():
+
+    ''' writes one entry per frame as renders are saved, each line is flushed so a crash loses at most one frame
+
+        append:     keep entries of an existing manifest instead of starting a new one '''
+
+    def __init__(self, path, checksum=True, append=False):
+
+        self.path = path
+        self.checksum = checksum
+        self.file = open(path, 'a' if append else 'w')
+
+    def append(self, renderPath, frame):
+
+        entry = manifestEntry(renderPath, frame, checksum=self.checksum)
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+        return entry
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,271 @@
+import os
+import re
+import csv
+import json
+import time
+import shutil
+import subprocess
+import numpy as np
+
+import spawnDirs
+import projectionStore
+import descriptionStore
+import renderManifest
+
+
+'''Multi process headless rendering for syntheticGen1, run with system python (not from inside blender)
+
+    Samples one scene plan for the whole run from a single seed, then starts N background blender processes on
+    the same .blend file, each renders a disjoint row range of that plan into its own shard dataset with its own
+    cycles thread budget:
+
+            blender -b scene.blend --python-exit-code 1 --python syntheticGen1.py -- --root <shardRoot> --fileName <name> --count n --seed s --plan <plan.npz> --planOnly
+            blender -b scene.blend --python-exit-code 1 --python syntheticGen1.py -- --root <shardDir> --fileName <name> --count n --plan <plan.npz> --frames start stop --threads t
+
+    blender exits with 0 when a --python script raises unless --python-exit-code is given. A shard only counts as
+    finished when its journal committed every frame of its range, shard dirs are never deleted otherwise.
+
+    When every shard finished, csvs, description files, renders, projection data and render manifests are
+    merged into one dataset with contiguous frame numbering. Every frame is rendered from the same plan row and scene
+    state as in a single process run with the same seed, a shard replays the material slot moves and the last planned
+    object, dependency and light poses of the rows before its range first. Timings and other run metadata differ.
+
+                root/subjectDir/
+                            |   fileName/               merged dataset
+                            |   fileName_shards/
+                                    |   fileName_plan.npz
+                                    |   fileName_shard0/
+                                    |   fileName_shard1/
+                                    |   ...
+'''
+
+
+def shardRanges(count, shards):
+
+    ''' split frames [0, count) into contiguous, disjoint [start, stop) ranges of near equal size '''
+
+    bounds = np.linspace(0, count, shards + 1).astype(int)
+    return [(int(bounds[k]), int(bounds[k + 1])) for k in range(shards) if bounds[k + 1] > bounds[k]]
+
+def planCommand(blender, blendFile, script, shardRoot, fileName, count, seed, planPath):
+
+    ''' blender command line that only samples the scene plan '''
+
+    return [blender, '-b', blendFile, '--python-exit-code', '1', '--python', script, '--',
+            '--root', shardRoot,
+            '--fileName', fileName,
+            '--count', str(count),
+            '--seed', str(seed),
+            '--plan', planPath,
+            '--planOnly']
+
+def shardCommand(blender, blendFile, script, shardDir, fileName, count, planPath, start, stop, threads):
+
+    ''' blender command line for one shard, renders plan rows [start, stop) '''
+
+    return [blender, '-b', blendFile, '--python-exit-code', '1', '--python', script, '--',
+            '--root', shardDir,
+            '--fileName', fileName,
+            '--count', str(count),
+            '--plan', planPath,
+            '--frames', str(start), str(stop),
+            '--threads', str(threads)]
+
+def committedFrames(shardDir, shardFileName):
+
+    ''' number of frames a shard committed to its journal (contiguous from frame 0), 0 without a journal '''
+
+    path = shardDir + shardFileName + '_journal.jsonl'
+    if not os.path.exists(path):
+        return 0
+
+    frames = -1     #first line is the header
+    with open(path, 'r') as file:
+        for line in file:
+            try: record = json.loads(line)
+            except json.JSONDecodeError: break   #torn last line from a crash
+
+            if frames >= 0 and record.get('frame') != frames: break
+            frames += 1
+
+    return max(frames, 0)
+
+def renumber(name, shardFileName, fileName, offset):
+
+    ''' '<i><shardFileName><ext>' -> '<i + offset><fileName><ext>' '''
+
+    match = re.match(r'(\d+)' + re.escape(shardFileName) + r'(.*)$', name)
+    if match is None:
+        raise ValueError(f'unexpected frame file name {name}')
+
+    return str(int(match.group(1)) + offset) + fileName + match.group(2), int(match.group(1))
+
+def mergeShards(shardDirs, root, subjectDir, fileName, frameCounts=None):
+
+    ''' merge finished shard datasets (in frame order) into root + subjectDir + fileName, returns frame count
+
+        frameCounts:    <list>  frames of each shard, global frame numbers are offset by these instead of the frames
+                                found in the csv and manifest '''
+
+    os.makedirs(root + subjectDir, exist_ok=True)
+    spawnDirs.spawnDirStruct(root=root, subjectDir=subjectDir, fileName=fileName)
+    outDir = root + subjectDir + fileName + '/'
+
+    descriptions = descriptionStore.descriptionWriter(outDir + 'descriptionJson/' + fileName)
+
+    offset = 0
+    header = None
+    rows = []
+    manifest = []
+    stores = []
+    npyFrames = []
+
+    for k, shardDir in enumerate(shardDirs):
+        shardFileName = os.path.basename(shardDir.rstrip('/'))
+        frames = 0
+
+        #csv rows, file names renumbered to their global frame
+        with open(shardDir + 'csvFile/' + shardFileName + '.csv', 'r', newline='') as file:
+            reader = csv.reader(file)
+            shardHeader = next(reader)
+            if header is None: header = shardHeader
+            for row in reader:
+                row[1], frame = renumber(row[1], shardFileName, fileName, offset)
+                frames = max(frames, frame + 1)
+                rows.append(row)
+
+        #renders
+        for name in os.listdir(shardDir + 'renders/'):
+            if re.match(r'\d+' + re.escape(shardFileName), name):
+                newName, _ = renumber(name, shardFileName, fileName, offset)
+                shutil.move(shardDir + 'renders/' + name, outDir + 'renders/' + newName)
+
+        #description records, frame and image path inside are updated too
+        descriptionPath = shardDir + 'descriptionJson/' + shardFileName
+        if descriptionStore.isStore(descriptionPath):
+            for meta in descriptionStore.descriptionReader(descriptionPath):
+                meta['imagePath'] = outDir + 'renders/' + str(meta['frame'] + offset) + fileName + os.path.splitext(meta['imagePath'])[1]
+                meta['frame'] += offset
+                descriptions.append(meta)
+
+        #render manifest
+        shardManifest = renderManifest.loadManifest(renderManifest.manifestPath(shardDir + 'renders/', shardFileName)) or []
+        for entry in shardManifest:
+            entry['fileName'], _ = renumber(entry['fileName'], shardFileName, fileName, offset)
+            frames = max(frames, entry['frame'] + 1)
+            entry['frame'] += offset
+            manifest.append(entry)
+
+        #projection data
+        storePath = shardDir + 'projectionMat/' + shardFileName
+        if projectionStore.isStore(storePath):
+            stores.append(storePath)
+        elif os.path.exists(storePath + '.npy'):
+            npyFrames += list(np.load(storePath + '.npy', allow_pickle=True))
+
+        offset += frameCounts[k] if frameCounts is not None else frames
+
+    with open(outDir + 'csvFile/' + fileName + '.csv', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    descriptions.close()
+
+    if manifest:
+        renderManifest.writeManifest(renderManifest.manifestPath(outDir + 'renders/', fileName), manifest)
+
+    if stores:
+        projectionStore.mergeStores(stores, outDir + 'projectionMat/' + fileName)
+    elif npyFrames:
+        projectionStore.saveNpy(npyFrames, outDir + 'projectionMat/' + fileName + '.npy')
+
+    return offset
+
+def main(blender, blendFile, script, root, subjectDir, fileName, count, shards, seed=0, threads=None, keepShards=False):
+
+    ''' render count frames of blendFile in shards background blender processes, then merge them
+
+        PARAMS:
+            blender:        path to blender executable
+            blendFile:      scene .blend file
+            script:         path to syntheticGen1.py
+            root, subjectDir, fileName:     merged dataset location, same as spawnDirs.spawnDirStruct
+            count:          <int>   total frames
+            shards:         <int>   number of background blender processes
+            seed:           <int>   seed of the scene plan every shard renders from
+            threads:        <int>   cycles threads per shard, default splits cpu cores evenly
+            keepShards:     <bool>  keep shard datasets after merging
+
+        Returns number of merged frames '''
+
+    if threads is None: threads = max(1, (os.cpu_count() or 1) // shards)
+
+    shardRoot = subjectDir + fileName + '_shards/'
+    os.makedirs(root + shardRoot, exist_ok=True)
+
+    processes = []
+    shardDirs = []
+
+    startTime = time.time()
+
+    #sample every frame once, shards only apply their rows
+    planPath = root + shardRoot + fileName + '_plan.npz'
+    with open(root + shardRoot + 'plan.log', 'w') as log:
+        returnCode = subprocess.call(planCommand(blender, blendFile, script, root + shardRoot, fileName, count, seed, planPath),
+                                     stdout=log, stderr=subprocess.STDOUT)
+    if returnCode != 0 or not os.path.exists(planPath):
+        raise RuntimeError(f'sampling the scene plan failed, see {root + shardRoot}plan.log')
+
+    print(f'sampled scene plan in {round(time.time() - startTime, 1)} seconds, seed {seed}')
+
+    for k, (start, stop) in enumerate(shardRanges(count, shards)):
+        shardFileName = f'{fileName}_shard{k}'
+        spawnDirs.spawnDirStruct(root=root, subjectDir=shardRoot, fileName=shardFileName)
+        shardDir = root + shardRoot + shardFileName + '/'
+
+        command = shardCommand(blender, blendFile, script, shardDir, shardFileName, count, planPath, start, stop, threads)
+        log = open(shardDir + 'render.log', 'w')
+        processes.append((subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log, shardDir, start, stop))
+        shardDirs.append(shardDir)
+
+        print(f'shard {k}: frames [{start}, {stop}), {threads} threads')
+
+    failed = []
+    for process, log, shardDir, start, stop in processes:
+        returnCode = process.wait()
+        log.close()
+
+        shardFileName = os.path.basename(shardDir.rstrip('/'))
+        frames = committedFrames(shardDir, shardFileName)
+        if returnCode != 0 or frames != stop - start:
+            failed.append(shardDir)
+            print(f'Warning: shard {shardDir} exited with {returnCode} after committing {frames} of {stop - start} frames, see {shardDir}render.log')
+
+    print(f'rendering finished in {round((time.time() - startTime)/60, 2)} minutes')
+
+    if failed:
+        raise RuntimeError(f'{len(failed)} shards failed, not merging, shard dirs are kept: {failed}')
+
+    frames = mergeShards(shardDirs, root, subjectDir, fileName, frameCounts=[stop - start for _, _, _, start, stop in processes])
+    print(f'merged {frames} frames into {root + subjectDir + fileName}/')
+
+    if not keepShards:
+        shutil.rmtree(root + shardRoot)
+
+    return frames
+
+
+if __name__ == "__main__":
+
+    main(blender =          "blender",
+         blendFile =        "/home/tuna/Documents/driving/Vision/syntheticData/blendFiles/basicEnvironment.blend",
+         script =           "/home/tuna/Documents/driving/Vision/syntheticData/utils/syntheticGen1.py",
+         root =             "/media/tuna/Pauls_USBA/",
+         subjectDir =       "adas/trial5/",
+         fileName =         "synthGenT5",
+         count =            1000,
+         shards =           8,
+         seed =             0,
+         threads =          None,
+         keepShards =       False)
@@ -3,10 +3,12 @@ from bpy_extras.object_utils import world_to_camera_view
 import csv
 import numpy as np
 import copy
-import time
 import random
 import sys
-import json
+import os
+import shutil
+import tempfile
+import argparse
 
 import bmesh
 import mathutils
@@ -14,6 +16,10 @@ import mathutils
 
 sys.path.append("/home/tuna/Documents/driving/Vision/syntheticData/")
 from utils import blenderTools2 as bt
+from utils import projectionStore as ps
+from utils import renderManifest as rm
+from utils import descriptionStore as ds
+from utils import instrumentation as it
 
 
 ''' This script must be run from within blender scripting environment
@@ -36,15 +42,35 @@ from utils import blenderTools2 as bt
 '''
 
 
+#compact per frame state, one row per light / object, json dicts are only built from these on export
+LIGHT_STATE = np.dtype([('energy', 'f8'), ('x', 'f8'), ('y', 'f8'), ('z', 'f8'), ('r', 'f8'), ('g', 'f8'), ('b', 'f8')])
+CAMERA_STATE = np.dtype([('focalLength', 'f8'), ('sensorWidth', 'f8'), ('x', 'f8'), ('y', 'f8'), ('z', 'f8'),
+                         ('theta', 'f8'), ('phi', 'f8'), ('omega', 'f8')])
+OBJECT_STATE = np.dtype([('x', 'f8'), ('y', 'f8'), ('z', 'f8'), ('theta', 'f8'), ('phi', 'f8'), ('omega', 'f8'),
+                         ('partDependency_x', 'f8'), ('partDependency_y', 'f8'), ('partDependency_z', 'f8'),
+                         ('partDependency_theta', 'f8'), ('partDependency_phi', 'f8'), ('partDependency_omega', 'f8')])
+
+
+def stateDict(row):
+
+    ''' {field: float} of a structured state row '''
+
+    return {name: float(row[name]) for name in row.dtype.names}
+
+
 class lighting():
 
     ''' class for storing all properties of lights within the scene'''
 
-    def __init__(self):
+    def __init__(self, rng=None):
 
         self.static = []        #tracking static lights
         self.dynamic = dict()   #tracking dynamic lights
         self.meta = dict()      #lighting meta data
+
+        #random generator for intensity sampling, pass a seeded one for reproducible runs
+        if rng is None: rng = np.random.default_rng()
+        self.rng = rng
         
         for light in bpy.data.collections['dynamicLights'].objects:
 
@@ -68,19 +94,30 @@ class lighting():
             if light.instance_type != "LIGHT": pass
             self.static.append(light)
 
-    def totalEnergy(self):
+        #one state row per light (dynamic first, then static), static rows are read once here
+        self.names = list(self.dynamic.keys()) + [light.name for light in self.static]
+        self.rows = {name: k for k, name in enumerate(self.names)}
+        self.types = [str(bpy.data.objects[name].data.type) for name in self.names]
+        self.state = np.zeros(len(self.names), dtype=LIGHT_STATE)
+        self.snapshot(self.names)
 
-        '''returns sum of light energy in seen (watts)'''
+    def snapshot(self, names=None):
 
-        energy = 0
-        for lightName in self.dynamic:
+        '''copy current energy, location and color of lights into their state rows, default every dynamic light'''
+
+        if names is None: names = self.dynamic.keys()
+
+        for lightName in names:
             light = bpy.data.objects[lightName]
-            energy += copy.copy(light.data.energy)
+            self.state[self.rows[lightName]] = (light.data.energy,
+                                                light.location.x, light.location.y, light.location.z,
+                                                light.color[0], light.color[1], light.color[2])
+
+    def totalEnergy(self):
 
-        for light in self.static:
-            energy += copy.copy(light.data.energy)
+        '''returns sum of light energy in seen (watts)'''
 
-        return energy
+        return float(self.state['energy'].sum())
             
     def lightCount(self):
 
@@ -90,53 +127,30 @@ class lighting():
 
     def metaData(self):
 
-        '''returns dictionary of lighting metadata'''
+        '''returns dictionary of lighting metadata, built from the state rows (see snapshot)'''
         
+        self.meta = dict()
         self.meta['totalEnergy'] = self.totalEnergy()
         self.meta['lightCount'] = self.lightCount()
         self.meta['individualMeta'] = dict()
 
-        for lightName in self.dynamic:
-            light = bpy.data.objects[lightName]
-            self.meta['individualMeta'][lightName] = dict()
-            self.meta['individualMeta'][lightName]['type'] = str(light.data.type)                    #str
-            self.meta['individualMeta'][lightName]['energy'] = copy.copy(light.data.energy)     #float
-            self.meta['individualMeta'][lightName]['x'] = copy.copy(light.location.x)           #float
-            self.meta['individualMeta'][lightName]['y'] = copy.copy(light.location.y)           #float
-            self.meta['individualMeta'][lightName]['z'] = copy.copy(light.location.z)           #float
-            self.meta['individualMeta'][lightName]['r'] = copy.copy(light.color[0])             #float (norm [0, 1])
-            self.meta['individualMeta'][lightName]['g'] = copy.copy(light.color[1])             #float (norm [0, 1])
-            self.meta['individualMeta'][lightName]['b'] = copy.copy(light.color[2])             #float (norm [0, 1])
-                       
-
-        for light in self.static:
-            lightName = light.name
-            self.meta['individualMeta'][lightName] = dict()
-            self.meta['individualMeta'][lightName]['type'] = str(light.data.type)                    #str
-            self.meta['individualMeta'][lightName]['energy'] = copy.copy(light.data.energy)     #float
-            self.meta['individualMeta'][lightName]['x'] = copy.copy(light.location.x)           #float
-            self.meta['individualMeta'][lightName]['y'] = copy.copy(light.location.y)           #float
-            self.meta['individualMeta'][lightName]['z'] = copy.copy(light.location.z)           #float
-            self.meta['individualMeta'][lightName]['r'] = copy.copy(light.color[0])             #float (norm [0, 1])
-            self.meta['individualMeta'][lightName]['g'] = copy.copy(light.color[1])             #float (norm [0, 1])
-            self.meta['individualMeta'][lightName]['b'] = copy.copy(light.color[2])             #float (norm [0, 1])
+        for k, lightName in enumerate(self.names):
+            self.meta['individualMeta'][lightName] = {'type': self.types[k]}                                     #str
+            self.meta['individualMeta'][lightName].update(stateDict(self.state[k]))    #energy, x, y, z, r, g, b (color norm [0, 1])
 
         return self.meta
 
-    def updateIntensity(self, light, domainRandomization):
+    def sampleIntensities(self, lightName, domainRandomization, count):
 
-        #break if light is not in dynamic collection
-        if light.name not in self.dynamic.keys():
-            return
-        
-        #break if light does not have intensity range set
-        if self.dynamic[light.name]['intensityRange'] == None:
-            return
+        ''' returns (count,) light energies, nan if the light is not dynamic or has no intensity range set '''
+
+        if lightName not in self.dynamic.keys() or self.dynamic[lightName]['intensityRange'] == None:
+            return np.full(count, np.nan)
 
         randomType = domainRandomization['lighting']['intensity']['random']['method']
 
-        low = self.dynamic[light.name]['intensityRange'][0]
-        high = self.dynamic[light.name]['intensityRange'][1]
+        low = self.dynamic[lightName]['intensityRange'][0]
+        high = self.dynamic[lightName]['intensityRange'][1]
 
         #normal distribution
         if randomType == 'normal':
@@ -144,16 +158,24 @@ class lighting():
             sigmaMultiplier = domainRandomization['lighting']['intensity']['random']['sigma']
             sigma = (high - low)*sigmaMultiplier
 
-            newIntensity = np.random.default_rng().normal(loc=self.dynamic[light.name]['initIntensity'], scale=sigma, size = 1)
+            intensities = self.rng.normal(loc=self.dynamic[lightName]['initIntensity'], scale=sigma, size=count)
 
             #clamp to constraint limit
-            newIntensity = np.clip(newIntensity, low, high)
+            intensities = np.clip(intensities, low, high)
 
         #uniform distribution
         else:
-            low = self.dynamic[light.name]['intensityRange'][0]
-            high = self.dynamic[light.name]['intensityRange'][1]
-            newIntensity = random.uniform(low, high)
+            intensities = self.rng.uniform(low, high, size=count)
+
+        return intensities
+
+    def updateIntensity(self, light, domainRandomization):
+
+        newIntensity = self.sampleIntensities(light.name, domainRandomization, 1)[0]
+
+        #light is not dynamic or does not have intensity range set
+        if np.isnan(newIntensity):
+            return
 
         light.data.energy = newIntensity
 
@@ -173,6 +195,16 @@ class camera():
         self.rotationPostions = []
 
         self.meta = dict()
+        self.state = np.zeros(1, dtype=CAMERA_STATE)
+        self.snapshot()
+
+    def snapshot(self):
+
+        '''copy current lens and pose into the state row'''
+
+        self.state[0] = (self.cam.data.lens, self.cam.data.sensor_width,
+                         self.cam.location.x, self.cam.location.y, self.cam.location.z,
+                         self.cam.rotation_euler[0], self.cam.rotation_euler[1], self.cam.rotation_euler[2])
 
     def toggleTracking(self):
 
@@ -191,14 +223,10 @@ class camera():
             tracking.up_axis = 'UP_Y'
 
     def metaData(self):
-        self.meta['focalLength'] = self.cam.data.lens                     #float
-        self.meta['sensorWidth'] = self.cam.data.sensor_width             #float
-        self.meta['x'] = copy.copy(self.cam.location.x)                   #float
-        self.meta['y'] = copy.copy(self.cam.location.y)                   #float
-        self.meta['z'] = copy.copy(self.cam.location.z)                   #float
-        self.meta['theta'] = copy.copy(self.cam.rotation_euler[0])        #float
-        self.meta['phi'] = copy.copy(self.cam.rotation_euler[1])          #float
-        self.meta['omega'] = copy.copy(self.cam.rotation_euler[2])        #float
+
+        '''returns dictionary of camera metadata (focalLength, sensorWidth, x, y, z, theta, phi, omega) from the state row'''
+
+        self.meta = stateDict(self.state[0])
 
         return self.meta
 
@@ -277,37 +305,228 @@ class classifications():
                 
             except: pass  
 
-    def metaData(self):
+        #one state row per classified object, dependency columns stay nan for objects without a dependency
+        self.names = list(self.classObjects.keys())
+        self.rows = {name: k for k, name in enumerate(self.names)}
+        self.state = np.full(len(self.names), np.nan, dtype=OBJECT_STATE)
 
-        '''return meta dict for all objects of interest in scene'''
-        
-        for objName in self.classObjects.keys():
+        #This needs changed, calling [1] is due to how i'm handling the class objects dict, which could be written better
+        self.dependencies = [self.classObjects[objName][1]['partDependency'] for objName in self.names]
+
+        self.snapshot(self.names)
+
+    def snapshot(self, names=None, dependencies=()):
+
+        '''copy current pose of objects (and their dependency) into their state rows, default every object.
+           dependencies: names of moved dependency parts, every object referencing one of them is refreshed too'''
+
+        if names is None: names = self.names
+
+        names = set(names)
+        for objName, depObj in zip(self.names, self.dependencies):
+            if depObj != None and depObj.name in dependencies: names.add(objName)
+
+        for objName in names:
+            k = self.rows[objName]
             obj = bpy.data.objects[objName]
-            self.meta[objName] = dict()
-            self.meta[objName]['x'] = copy.copy(obj.location.x)              #float
-            self.meta[objName]['y'] = copy.copy(obj.location.y)              #float
-            self.meta[objName]['z'] = copy.copy(obj.location.z)              #float
-            self.meta[objName]['theta'] = copy.copy(obj.rotation_euler[0])   #float
-            self.meta[objName]['phi'] = copy.copy(obj.rotation_euler[1])     #float
-            self.meta[objName]['omega'] = copy.copy(obj.rotation_euler[2])   #float
+            row = [obj.location.x, obj.location.y, obj.location.z, obj.rotation_euler[0], obj.rotation_euler[1], obj.rotation_euler[2]]
+
+            depObj = self.dependencies[k]
+            if depObj != None:
+                row += [depObj.location.x, depObj.location.y, depObj.location.z, depObj.rotation_euler[0], depObj.rotation_euler[1], depObj.rotation_euler[2]]
+            else:
+                row += [np.nan]*6
+
+            self.state[k] = tuple(row)
 
+    def metaData(self):
+
+        '''return meta dict for all objects of interest in scene, built from the state rows (see snapshot)'''
         
-            #This needs changed, calling [1] is due to how i'm handling the class objects dict, which could be written better
-            depObj = self.classObjects[objName][1]['partDependency']
+        self.meta = dict()
+
+        for k, objName in enumerate(self.names):
+            meta = stateDict(self.state[k])
+
+            depObj = self.dependencies[k]
             if depObj != None:
-                self.meta[objName]['partDependency'] = depObj.name                       #bpy struct
-                self.meta[objName]['partDependency_x'] = depObj.location.x               #float
-                self.meta[objName]['partDependency_y'] = depObj.location.y               #float
-                self.meta[objName]['partDependency_z'] = depObj.location.z               #float
-                self.meta[objName]['partDependency_theta'] = depObj.rotation_euler[0]    #float
-                self.meta[objName]['partDependency_phi'] = depObj.rotation_euler[1]      #float
-                self.meta[objName]['partDependency_omega'] = depObj.rotation_euler[2]    #float
+                meta['partDependency'] = depObj.name     #str
+            else:
+                meta = {key: value for key, value in meta.items() if not key.startswith('partDependency')}
+
+            self.meta[objName] = meta
 
         return self.meta
 
               
 
 
+def scenePlan(renderCount, cam, lights, classObjs, cameraParams, domainRandomization, voxels=None):
+
+    ''' sample every per frame parameter of a run up front into columnar arrays, the render loop only applies rows.
+        random, np.random and lights.rng must be seeded first, sampling order is fixed so one seed always gives one plan
+
+        voxels:     <None, dict>    passed to bt.generatePositions, closed volume constraints are sampled from a cached
+                                    occupancy grid, eg. {'resolution': 32, 'cacheDir': path}
+
+        keys:
+            'camera/location', 'camera/rotation'        (count, 3)
+            'light/<name>/location'                     (count, 3)
+            'light/<name>/energy'                       (count,)    nan keeps the current energy
+            'object/<name>/class'                       (count,)    classification index (label, custom bbox and split)
+            'object/<name>/location'                    (count, 3)  nan keeps the object where it is
+            'object/<name>/dependencyLocation'          (count, 3)
+            'material/<name>'                           (count,)    material slot moved to the front, -1 keeps the order '''
+
+    plan = dict()
+
+    #camera translation
+    if cameraParams['translation']['active']:
+        randomType = cameraParams['translation']['random']['method']
+        positions = bt.generatePositions(constraintObj=      cam.constraint, 
+                                         dynamicObj=         cam.cam, 
+                                         randomType=         randomType, 
+                                         count=              renderCount,
+                                         voxels=             voxels
+                                         )
+    else:
+        positions = [cam.initLoc]*renderCount
+    plan['camera/location'] = bt.planColumn(positions, renderCount)
+
+    #camera rotation
+    if cameraParams['rotation']['active']:
+        randomType = cameraParams['rotation']['random']['method']
+        constraint = cameraParams['rotation']['constraint']
+        rotations = bt.generateRotations(constraint=         constraint, 
+                                         dynamicObj=         cam.cam, 
+                                         randomType=         randomType, 
+                                         count=              renderCount
+                                         )
+    else:
+        rotations = [cam.initRot]*renderCount
+    plan['camera/rotation'] = bt.planColumn(rotations, renderCount)
+
+    #lights, one batch per light instead of one constraint evaluation per frame
+    for lightName in lights.dynamic.keys():
+        light = bpy.data.objects[lightName]
+        positions = bt.generatePositions(constraintObj= lights.dynamic[lightName]['constraint'],
+                                         dynamicObj=    light,
+                                         randomType=    domainRandomization['lighting']['translation']['random']['method'],
+                                         count=         renderCount,
+                                         voxels=        voxels
+                                         )
+        plan[f'light/{lightName}/location'] = bt.planColumn(positions, renderCount)
+        plan[f'light/{lightName}/energy'] = lights.sampleIntensities(lightName, domainRandomization, renderCount)
+
+    #classification objects, frames are handed to each class in order of its split, leftover frames go to the last class
+    for objName in classObjs.classObjects.keys():
+
+        obj = bpy.data.objects[objName]
+        klasses = list(classObjs.classObjects[objName].keys())
+
+        classIdx = np.zeros(renderCount, dtype=np.int64)
+        locations = np.full((renderCount, 3), np.nan)
+        dependencyLocations = np.full((renderCount, 3), np.nan)
+
+        split = 0
+        for klass in klasses:
+
+            #frames [first, last) use this class
+            first = int(renderCount * split)
+            split += classObjs.classObjects[objName][klass]['split']     #float
+            last = renderCount if klass == klasses[-1] else int(renderCount * split)
+
+            #every row of the range gets its own pose, int(renderCount * split) can be short by the rounding leftovers
+            numOfPositions = last - first
+            classIdx[first:last] = klass
+
+            #if constraint provided and part is dynamic
+            constraint = classObjs.classObjects[objName][klass]['constraint']
+            if constraint and (objName in bpy.data.collections['dynamicParts'].objects):
+                points = bt.generatePositions(constraintObj=    constraint, 
+                                              dynamicObj=       obj,        
+                                              randomType=       'uniform',  
+                                              count=            numOfPositions,
+                                              voxels=           voxels)
+                locations[first:last] = bt.planColumn(points, last - first)
+
+            #if dependency and dependency is dynamic, a constraint means the dependency should move
+            dependency = classObjs.classObjects[objName][klass]['partDependency']                   #object pointer
+            if dependency and (dependency.name in bpy.data.collections['dynamicParts'].objects):
+                points = bt.generatePositions(constraintObj=    classObjs.classObjects[objName][klass]['dependencyConstraint'],
+                                              dynamicObj=       dependency, 
+                                              randomType=       'uniform',  
+                                              count=            numOfPositions,
+                                              voxels=           voxels)
+                dependencyLocations[first:last] = bt.planColumn(points, last - first)
+
+        plan[f'object/{objName}/class'] = classIdx
+        plan[f'object/{objName}/location'] = locations
+        plan[f'object/{objName}/dependencyLocation'] = dependencyLocations
+
+    #material slot moved to the front every frame
+    for obj in bpy.data.objects:
+        if len(obj.material_slots) > 1:
+            if domainRandomization['material']['active']:
+                plan[f'material/{obj.name}'] = np.array([random.randint(1, (len(obj.material_slots) - 1)) for _ in range(renderCount)], dtype=np.int64)
+            else:
+                plan[f'material/{obj.name}'] = np.full(renderCount, -1, dtype=np.int64)
+
+    return plan
+
+
+def dryRunPaths(paths):
+
+    ''' copy of paths with every output folder moved under <root>dryRun/, folders are created '''
+
+    root = paths['root'] + 'dryRun/'
+
+    dryPaths = dict(paths)
+    dryPaths['root'] = root
+    for key, folder in [('renders', 'renders/'), ('csv', 'csvFile/'), ('jsonFile', 'jsonFile/'),
+                        ('projectionMat', 'projectionMat/'), ('descriptionJson', 'descriptionJson/')]:
+        dryPaths[key] = root + folder
+        if key != 'renders': os.makedirs(dryPaths[key], exist_ok=True)
+
+    return dryPaths
+
+def resumeFrames(resume, startFrame, storePath, isStore, journalPath):
+
+    ''' resumeFrames argument of a store writer, None writes a fresh store. A journal that committed frames whose store
+        is gone cannot be continued, frame 0 simply starts the store over '''
+
+    if not resume: return None
+
+    if startFrame > 0 and not isStore(storePath):
+        raise FileNotFoundError(f'journal {journalPath} committed {startFrame} frames but the store {storePath} is missing, '
+                                f'restore the store or delete the journal to start the run over')
+
+    return startFrame
+
+def lastPlanned(column, stop, rows=None):
+
+    ''' index of the last row before stop whose value is planned (not nan), None if every row keeps the scene as is
+
+        PARAMS:
+            column:     plan column, (count,) or (count, 3)
+            stop:       <int>   first row not considered
+            rows:       <None, bool array (count,)>  only consider these rows '''
+
+    planned = ~np.isnan(column[:stop])
+    if planned.ndim > 1: planned = planned.all(axis=1)
+    if rows is not None: planned &= rows[:stop]
+
+    index = np.flatnonzero(planned)
+    return int(index[-1]) if len(index) else None
+
+def writeRows(file, data, rows):
+
+    ''' write csv rows of a single frame and flush them '''
+
+    data.writerows(rows)
+    file.flush()
+
+
 class objects():
 
     def __init__(self):
@@ -324,28 +543,102 @@ class objects():
                                         }
             
 
-def main(renderInfo, cameraParams, domainRandomization, paths):
+def main(renderInfo, cameraParams, domainRandomization, paths, generalinfo=None):
     print('')
     
     #debugging
     #debugFile = open("/home/tuna/Documents/driving/Vision/syntheticData/bpyTest.txt", 'w')
 
-    file = open(paths['csv'] + paths['fileName'] + ".csv", "w")
-    data = csv.writer(file)
+    #'stream' reduces projections to bboxes inside the render loop and writes them straight to the csv,
+    # raw vertex dumps are then only saved if requested
+    annotation = renderInfo.get('annotation', 'vertices')                  #<'vertices', 'stream'>
+    saveVertices = renderInfo.get('saveVertices', annotation != 'stream')  #bool
+    projectionFormat = renderInfo.get('projectionFormat', 'npy')            #<'npy', 'store', 'store16'>
 
     #top row column names
     labelID = ["use", "fileName", "classification", "xMin", "yMin", None, None, "xMax", "yMax", None, None, "camX", "camY", "camZ"]
-    data.writerow(labelID)
+    if annotation == 'stream': labelID += ["depthMin", "depthMax"]
 
     renderCount = renderInfo['count']  #int
 
+    #plan rows [firstRow, lastRow) are rendered as frames 0, 1, ..., lets shards split a single plan
+    firstRow, lastRow = renderInfo.get('frames') or (0, renderCount)     #<None, [int, int]>
+    frameCount = lastRow - firstRow
+
+    #dry runs apply the plan and write every annotation output but never render (see renderInfo['dryRun']), every
+    # output (plan, journal, csv, descriptions, projections, timings, thumbnails) goes to <root>dryRun/ so a live run
+    # in the same root is never overwritten and a later real run never skips frames that were only dry run
+    dryRun = renderInfo.get('dryRun', False)     #bool
+    if dryRun: paths = dryRunPaths(paths)
+
+    #per frame journal, a crashed run restarted with renderInfo['resume'] skips every committed frame
+    journal = bt.runJournal(paths['root'] + paths['fileName'] + '_journal.jsonl')
+    resume = renderInfo.get('resume', False)    #bool
+    if resume: header, committed = journal.load()
+    else: header, committed = None, []
+
+    #a saved plan is reused instead of resampled (resume, or a plan shared by render shards)
+    planPath = renderInfo.get('plan') or paths['root'] + paths['fileName'] + '_plan.npz'
+    if (resume or renderInfo.get('plan')) and os.path.exists(planPath):
+        plan = bt.loadPlan(planPath)
+        if int(plan['count']) != renderCount:
+            raise ValueError(f"{planPath} was sampled for {int(plan['count'])} renders, renderInfo['count'] is {renderCount}")
+    else:
+        plan = None
+
+    #seed every random source so a shard (see renderShards.py) or a rerun is reproducible,
+    # a resumed run always reuses the seed of the run it continues
+    if plan is not None:
+        seed = int(plan['seed'])
+    elif header is not None:
+        seed = header['seed']
+    else:
+        seed = renderInfo.get('seed', None)     #<int, None>
+        if seed is None: seed = int(np.random.SeedSequence().entropy % 2**32)
+
+    if header is not None and [header['seed'], header['count'], header.get('frames', [0, header['count']])] != [seed, renderCount, [firstRow, lastRow]]:
+        raise ValueError(f'journal {journal.path} belongs to a different run, cannot resume')
+
+    random.seed(seed)
+    np.random.seed(seed)
+    rng = np.random.default_rng(seed)
+
     #define blender scene
     scene = bpy.context.scene
 
+    #cycles cpu thread budget, lets several background blender processes share one machine
+    if renderInfo.get('threads'):
+        scene.render.threads_mode = 'FIXED'
+        scene.render.threads = renderInfo['threads']
+
+    #output image format, renders are written once to scene.render.filepath by render(write_still=True)
+    if generalinfo is None: generalinfo = dict()
+    extension = bt.setImageFormat(scene, generalinfo.get('imageFormat', {'format': 'PNG'}))
+    initFilePath = scene.render.filepath
+    initUseExtension = scene.render.use_file_extension
+    scene.render.use_file_extension = False
+
     #gather current resolution for multiplication later on
     res_x = scene.render.resolution_x
     res_y = scene.render.resolution_y
 
+    #optional tiny low sample render per dry run frame, eg. renderInfo['thumbnail'] = {'scale': 10, 'samples': 4},
+    # projections still use the full resolution above
+    thumbnail = renderInfo.get('thumbnail') if dryRun else None
+    initPercentage = scene.render.resolution_percentage
+    initSamples = scene.cycles.samples
+    if thumbnail:
+        scene.render.resolution_percentage = thumbnail.get('scale', 10)
+        scene.cycles.samples = thumbnail.get('samples', 4)
+        thumbnailDir = paths['root'] + 'thumbnails/'
+        os.makedirs(thumbnailDir, exist_ok=True)
+
+    #points used for bbox projection, hulls are cached per object and only rebuilt when the mesh datablock or its topology
+    # changes, code that moves vertices in place calls proxies.invalidate(obj)
+    projection = renderInfo.get('projection', 'vertices')     #<'vertices', 'hull', 'boundBox'>
+    if projection != 'vertices': proxies = bt.projectionProxies(method=projection)
+    else: proxies = None
+
     ############################################
     ### <<<  Define all Basic Part info  >>> ###
     ############################################
@@ -359,7 +652,7 @@ def main(renderInfo, cameraParams, domainRandomization, paths):
     ### <<< Define all lighting Properties >>> ###
     ##############################################
 
-    lights = lighting()
+    lights = lighting(rng=rng)
      
     #async io terminate process task
     
@@ -375,44 +668,27 @@ def main(renderInfo, cameraParams, domainRandomization, paths):
     if cameraParams['tracking']['active']: 
         cam.toggleTracking()
 
-    #generate dynamic camera translation positions
-    if cameraParams['translation']['active']:
-        randomType = cameraParams['translation']['random']['method']
-        print(f'randomtype:{randomType}')
-        cam.translationPostions = bt.generatePositions(constraintObj=      cam.constraint, 
-                                                        dynamicObj=     cam.cam, 
-                                                        randomType=     randomType, 
-                                                        count=          renderCount
-                                                        )
-        print(f'generrated postions')
-        #storing positions for description json
-        cameraParams['translation']['positions'] = cam.translationPostions
-    
-    #generate static camera positions
-    elif not cameraParams['translation']['active']:
-        for i in range(renderCount):
-            cam.translationPostions.append(cam.initLoc)
-        #storing positions for description json
-        cameraParams['translation']['positions'] = cam.translationPostions
-
-    #generate dynamic camera rotations
-    if cameraParams['rotation']['active']:
-        randomType = cameraParams['rotation']['random']['method']
-        constraint = cameraParams['rotation']['constraint']
-        cam.rotationPostions = bt.generateRotations(constraint=         constraint, 
-                                                    dynamicObj=         cam.cam, 
-                                                    randomType=         randomType, 
-                                                    count=              renderCount
-                                                    )
-        #store positions for description json
-        cameraParams['rotation']['positions'] = cam.rotationPostions
-    
-    #generate static camera rotations
-    elif not cameraParams['rotation']['active']:
-        for i in range(renderCount):
-            cam.rotationPostions.append(cam.initRot)
-        #storing positions for description json
-        cameraParams['rotation']['positions'] = cam.rotationPostions
+    ###############################################
+    ### <<< Sample every frame of the run >>> ###
+    ###############################################
+
+    if plan is None:
+        #occupancy grids of volume constraints are reused by every later run on the same meshes, eg. renderInfo['voxels'] = {'resolution': 32}
+        voxels = renderInfo.get('voxels')
+        if voxels: voxels = dict({'cacheDir': paths['root'] + 'voxels/'}, **voxels)
+
+        plan = scenePlan(renderCount, cam, lights, classObjs, cameraParams, domainRandomization, voxels=voxels)
+        plan['seed'], plan['count'] = np.array(seed), np.array(renderCount)
+        bt.savePlan(planPath, plan)
+        print(f'sampled scene plan for {renderCount} renders: {planPath}')
+
+    #storing positions for description json
+    cameraParams['translation']['positions'] = plan['camera/location'].tolist()
+    cameraParams['rotation']['positions'] = plan['camera/rotation'].tolist()
+
+    #only sample the plan, eg. once before starting render shards
+    if renderInfo.get('planOnly'):
+        return plan
 
     
 
@@ -488,227 +764,300 @@ def main(renderInfo, cameraParams, domainRandomization, paths):
              
                 '''
 
-    #loop through all classification objects, detirmine positions for each render
-    
-    for objName in classObjs.classObjects.keys():
+    journal.start({'seed': seed, 'count': renderCount, 'frames': [firstRow, lastRow]}, committed)
+    startFrame = len(committed)
+    if resume: print(f'resuming at frame {startFrame} of {frameCount}')
 
-        obj = bpy.data.objects[objName]
+    #csv is rewritten from the journal so rows of a frame that crashed mid write are dropped
+    file = open(paths['csv'] + paths['fileName'] + ".csv", "w", newline='')
+    data = csv.writer(file)
+    data.writerow(labelID)
+    for record in committed:
+        data.writerows(record['rows'])
+    file.flush()
 
-        for klass in classObjs.classObjects[objName].keys():
+    #debugFile.close()
 
-            split = classObjs.classObjects[objName][klass]['split']                                 #float
 
-            #calulate how many positions should store for this class
-            numOfPositions = int(renderCount * split)           #int
+    #setCoordinates = [] #array storing projection coordinates of each object in every frame
+    setCoordinates = [record['coordinates'] for record in committed if 'coordinates' in record]
+
+    #fixed width projection store, frames are appended to disk as they are rendered instead of held in setCoordinates
+    if saveVertices and projectionFormat != 'npy':
+        projWriter = ps.projectionWriter(paths['projectionMat'] + paths['fileName'],
+                                         objectsPerFrame=   len(classObjs.classObjects),
+                                         quantize=          projectionFormat == 'store16',
+                                         resumeFrames=      resumeFrames(resume, startFrame, paths['projectionMat'] + paths['fileName'], ps.isStore, journal.path))
+    else:
+        projWriter = None
+
+    #scene description of every frame, one jsonl record each with an offset index for random access
+    descriptionPath = paths['descriptionJson'] + paths['fileName']
+    descriptions = ds.descriptionWriter(descriptionPath, resumeFrames=resumeFrames(resume, startFrame, descriptionPath, ds.isStore, journal.path))
+
+    #per frame resolution, byte size and checksum so buildDataSet5 never has to decode a render
+    #a dry run has no renders, an existing manifest of a real run is left alone
+    if dryRun: manifest = None
+    else: manifest = rm.manifestWriter(rm.manifestPath(paths['renders'], paths['fileName']), append=resume)
+
+    #material slot order carries over between frames, replay the moves of every row before the first one rendered
+    # here so a resumed run or a shard starts from the same slot order as an uninterrupted run
+    replayStop = firstRow + startFrame
+    for key in plan.keys():
+        if key.startswith('material/'):
+            for idx in plan[key][:replayStop]:
+                if idx > 0: bt.setMaterialSlot(bpy.data.objects[key[len('material/'):]], int(idx))
+
+    #a nan pose keeps the object, dependency or light where the previous frame left it, put each of them at its last
+    # planned pose before the first row rendered so a resumed run or a shard starts from the same scene as well
+    for lightName in lights.dynamic.keys():
+        light = bpy.data.objects[lightName]
 
+        row = lastPlanned(plan[f'light/{lightName}/energy'], replayStop)
+        if row is not None: light.data.energy = plan[f'light/{lightName}/energy'][row]
 
-            constraint = classObjs.classObjects[objName][klass]['constraint']
+        row = lastPlanned(plan[f'light/{lightName}/location'], replayStop)
+        if row is not None: bt.updateAbsPosition(light, [plan[f'light/{lightName}/location'][row]], 0)
 
-            #if constraint provided and part is dynamic
-            if constraint and (objName in bpy.data.collections['dynamicParts'].objects):
-                points = bt.generatePositions(constraintObj=    constraint, 
-                                              dynamicObj=       obj,        
-                                              randomType=       'uniform',  
-                                              count=            numOfPositions)
-                
-                classObjs.classObjects[objName][klass]['positions'] = points 
-            
+    for object in classObjs.classObjects.keys():
+        row = lastPlanned(plan[f'object/{object}/location'], replayStop)
+        if row is not None: bt.updateAbsPosition(bpy.data.objects[object], [plan[f'object/{object}/location'][row]], 0)
 
+        #the dependency moved in a row belongs to that row's class, classes can share a dependency object
+        classes = plan[f'object/{object}/class']
+        dependencyClasses = dict()
+        for klass in np.unique(classes[:replayStop]):
+            dependency = classObjs.classObjects[object][int(klass)]['partDependency']
+            if dependency: dependencyClasses.setdefault(dependency.name, []).append(klass)
 
-            #identify klassification parameters
-            dependency = classObjs.classObjects[objName][klass]['partDependency']                   #object pointer
-            
-            #if dependency and dependency is dynamic
-            if dependency and (dependency.name in bpy.data.collections['dynamicParts'].objects):
+        for dependencyName, klasses in dependencyClasses.items():
+            row = lastPlanned(plan[f'object/{object}/dependencyLocation'], replayStop, np.isin(classes, klasses))
+            if row is not None: bt.updateAbsPosition(bpy.data.objects[dependencyName], [plan[f'object/{object}/dependencyLocation'][row]], 0)
 
-                #if a constraint is provided we assume part should move
-                dependencyConstraint = classObjs.classObjects[objName][klass]['dependencyConstraint']   #object pointer
+    #output writer, with renderInfo['asyncWrite'] renders are saved to a local staging dir and csv rows, description
+    # json, projection data, manifest entries and journal commits are written while the next frame renders
+    asyncWrite = renderInfo.get('asyncWrite', False)    #bool
+    writer = bt.asyncWriter(maxQueue=renderInfo.get('writeQueue', 32), threaded=asyncWrite)
+    if asyncWrite: stageDir = (renderInfo.get('stageDir') or tempfile.mkdtemp(prefix='synthGen_')).rstrip('/') + '/'
+    else: stageDir = None
 
-                #detirmine positions
-                points = bt.generatePositions(constraintObj=    dependencyConstraint,
-                                              dynamicObj=       dependency, 
-                                              randomType=       'uniform',  
-                                              count=            numOfPositions)
-         
-                
-                #add list of points to the dict
-                classObjs.classObjects[objName][klass]['dependencyPositions'] = points  
+    #per phase timings of every frame, rolling statistics drive the eta (summary: python instrumentation.py <file>)
+    timer = it.frameTimer(paths['root'] + paths['fileName'] + '_timings.jsonl', append=resume)
 
-
-            #debugging
-            #debugFile.write(f'index: {objName} \n')
-            #debugFile.write(f'klass: {klass} \n')
-            #debugFile.write(f'numOfPos: {numOfPositions} \n')
-            #debugFile.write(f'positions: {points} \n')
-            #debugFile.write('\n')
-    #debugFile.close()
-
-
-    #setCoordinates = [] #array storing projection coordinates of each object in every frame
-    setCoordinates = []
+    #cProfile / tracemalloc dumps of sampled frames, eg. renderInfo['profile'] = {'every': 100, 'frames': [0], 'memory': True}
+    if renderInfo.get('profile'): profiler = it.profiler(paths['root'] + 'profile/', **renderInfo['profile'])
+    else: profiler = None
 
     ### MAIN RENDER LOOP ###
-    for i in range(renderCount):
-
-        startTime = time.time()
+    #the scene is restored, queued output written and every handle closed on success, on an exception and on
+    # KeyboardInterrupt alike, a failure of the background writer itself is raised after the cleanup
+    i = startFrame
+    try:
+        for i in range(startFrame, frameCount):
 
-        cam.cam.location = copy.copy(cam.translationPostions[i])
+            timer.start(i)
+            if profiler and profiler.due(i): profiler.start(f"{paths['fileName']}_frame{i}")
 
-        #NOTE: if cameraParams['tracking']['active'], camera will auto rotate to tracking position first, then we can apply a rotation op after wards
-        cam.cam.rotation_euler = copy.copy(cam.rotationPostions[i])
+            #every frame only applies its row of the plan, nothing is sampled inside the loop
+            row = firstRow + i
 
+            cam.cam.location = plan['camera/location'][row]
 
-        if domainRandomization['material']['active']:
-            for obj in bpy.data.objects:
-                if len(obj.material_slots) > 1:
-                    bpy.ops.object.select_all(action='DESELECT')
+            #NOTE: if cameraParams['tracking']['active'], camera will auto rotate to tracking position first, then we can apply a rotation op after wards
+            cam.cam.rotation_euler = plan['camera/rotation'][row]
+            cam.snapshot()
+            timer.lap('poseApply')
 
-                    obj.select_set(True)
-                    #bpy.ops.object.editmode_toggle()
+            #move the planned material slot to the front
+            for key in plan.keys():
+                if key.startswith('material/') and plan[key][row] > 0:
+                    bt.setMaterialSlot(bpy.data.objects[key[len('material/'):]], int(plan[key][row]))
+            timer.lap('materials')
 
-                    #select random material from existin slots
-                    idx = random.randint(1, (len(obj.material_slots) - 1))
-                    holder = []
-                    holder.append(obj.material_slots[idx].material)
+            for lightName in lights.dynamic.keys():
+                light = bpy.data.objects[lightName]
 
-                    for j in range(len(obj.material_slots)):
-                        if j != idx:
-                            holder.append(obj.material_slots[j].material)
+                energy = plan[f'light/{lightName}/energy'][row]
+                if not np.isnan(energy): light.data.energy = energy
 
-                    obj.material_slots[0].material = holder[0]
+                coord = plan[f'light/{lightName}/location'][row]
+                if not np.isnan(coord).any(): bt.updateAbsPosition(light, [coord], 0)
 
-                    for j in range(1, len(obj.material_slots)):
-                        obj.material_slots[j].material = holder[j]
+            lights.snapshot()
+            timer.lap('lights')
 
-                    bpy.ops.object.select_all(action='DESELECT')
-                    
-                    #NOTE: there exists bpy.ops.object.material_slot_select() which should make a desired material the active one, however this errors on my version, \
-                    #        therefore resorting to reordering loop as insert doesnt work
-                     
+            #list to hold image coordinates of each object in the frame thats selected
+            frameCoordinates = [] 
+            frameRows = []
 
+            #objects and dependencies moved this frame, only their state rows are refreshed
+            movedObjects = []
+            movedDependencies = []
 
-        for lightName in lights.dynamic.keys():
-            light = bpy.data.objects[lightName]
-        
-            lights.updateIntensity(light, domainRandomization=domainRandomization)
-            coord = bt.generatePositions(constraintObj= lights.dynamic[lightName]['constraint'],
-                                         dynamicObj= light,
-                                         randomType= domainRandomization['lighting']['translation']['random']['method'],
-                                         count= 1
-                                         )
-            bt.updateAbsPosition(light, coord, 0)
-
-        #list to hold image coordinates of each object in the frame thats selected
-        frameCoordinates = [] 
-
-        #loop through all objects with classifications
-        for object in classObjs.classObjects.keys():
-            obj = bpy.data.objects[object]
-           
-            klassifications = list(classObjs.classObjects[object].keys())   #list of integers
-            split = 0
-
-            #loop through each class, detirmine which class is current split
-            for klass in klassifications:
-
-                #used to shift indexing from total count 
-                idxShift = int(renderCount * split)
+            #loop through all objects with classifications
+            for object in classObjs.classObjects.keys():
+                obj = bpy.data.objects[object]
 
-                #split value <float [0., 1.]>
-                split += classObjs.classObjects[object][klass]['split']     #float
-                
-                if i < int(renderCount * split): break
-
-            #if main part is dynamic
-            objPositions = classObjs.classObjects[object][klass]['positions']
-            if objPositions and objPositions != []:
-                position = objPositions[i - idxShift]
-                bt.updateAbsPosition(obj, [position], 0)   
-
-            #if dependency that will move
-            dependency = classObjs.classObjects[object][klass]['partDependency']    #object pointer
-            if dependency:
-                position = classObjs.classObjects[object][klass]['dependencyPositions'][i - idxShift]   #[x, y, z]
-                bt.updateAbsPosition(dependency, [position], 0)
+                #class of this frame (label, custom bbox and split)
+                klass = int(plan[f'object/{object}/class'][row])
+
+                #if main part is dynamic
+                position = plan[f'object/{object}/location'][row]
+                if not np.isnan(position).any():
+                    bt.updateAbsPosition(obj, [position], 0)   
+                    movedObjects.append(object)
+
+                #if dependency that will move
+                dependency = classObjs.classObjects[object][klass]['partDependency']    #object pointer
+                position = plan[f'object/{object}/dependencyLocation'][row]             #[x, y, z]
+                if dependency and not np.isnan(position).any():
+                    bt.updateAbsPosition(dependency, [position], 0)
+                    movedDependencies.append(dependency.name)
+                timer.lap('poseApply')
             
-            #Logic to handle custom bboxes for vert projections
-            if classObjs.classObjects[object][klass]['customBBox']:
-                obj = classObjs.classObjects[object][klass]['customBBox']
+                #Logic to handle custom bboxes for vert projections
+                if classObjs.classObjects[object][klass]['customBBox']:
+                    obj = classObjs.classObjects[object][klass]['customBBox']
                 
-            else:
-                obj = bpy.data.objects[object]
+                else:
+                    obj = bpy.data.objects[object]
 
-            #project 3D vertecies to 2D image plane
-            imageCoordinates = bt.convertVertices(scene, cam.cam, obj, res_x, res_y)
+                #project 3D vertecies (or cached hull/bound_box proxy points) to 2D image plane
+                if proxies: localCoords = proxies.points(obj)
+                else: localCoords = None
+                imageCoordinates = bt.projectVertices(scene, cam.cam, obj, res_x, res_y, localCoords=localCoords).tolist()
 
-            #append projected vertecies of each object to the image array
-            frameCoordinates.append(imageCoordinates)
+                #append projected vertecies of each object to the image array
+                if saveVertices:
+                    frameCoordinates.append(imageCoordinates)
 
-            #classification label
-            label = classObjs.classObjects[object][klass]['label']
+                #classification label
+                label = classObjs.classObjects[object][klass]['label']
 
-            #write instance to csv                                         Ax    Ay    Bx    By    Cx    Cy    Dx    Dy
-            instance = [None, str(i) + paths['fileName'] + ".png", label, None, None, None, None, None, None, None, None, cam.cam.location.x, cam.cam.location.y, cam.cam.location.z]
-            data.writerow(instance)
+                #write instance to csv                                         Ax    Ay    Bx    By    Cx    Cy    Dx    Dy
+                instance = [None, str(i) + paths['fileName'] + extension, label, None, None, None, None, None, None, None, None, cam.cam.location.x, cam.cam.location.y, cam.cam.location.z]
 
-            
+                #reduce to bbox now instead of in buildDataSet5 (pixel coordinates, normalized later)
+                if annotation == 'stream':
+                    xMin, xMax, yMin, yMax, depthMin, depthMax = bt.projectionBounds(imageCoordinates)
+                    instance[3], instance[4], instance[7], instance[8] = xMin, yMin, xMax, yMax
+                    instance += [depthMin, depthMax]
+
+                frameRows.append(instance)
+                timer.lap('projection')
+
+            #one description record per frame, metaData() builds new dicts from the state rows so the writer can keep them
             metaJson = dict()
-            metaJson['imagePath'] = paths['renders'] + str(i) + paths['fileName'] + ".png"
+            metaJson['frame'] = i
+            metaJson['imagePath'] = paths['renders'] + str(i) + paths['fileName'] + extension
             metaJson['resolutionX'] = scene.render.resolution_x
             metaJson['resolutionY'] = scene.render.resolution_y
+            classObjs.snapshot(movedObjects, dependencies=movedDependencies)
             metaJson['lights'] = lights.metaData()
             metaJson['camera'] = cam.metaData()
             metaJson['objects'] = classObjs.metaData()
-            metaPath = paths['descriptionJson'] + str(i) + paths['fileName'] + '.json'
-            metaJson = json.dumps(metaJson, indent=4)
-            meta = open(metaPath, 'w')
-            meta.write(metaJson)
-
-            
-        #append image array to full render set array
-        setCoordinates.append(frameCoordinates)    
-
-        #render
-        bpy.ops.render.render(write_still=True)
-        bpy.data.images['Render Result'].save_render(paths['renders'] + str(i) + paths['fileName'] + ".png", scene=bpy.context.scene)
-
-        endTime = time.time()
-        iterElapsed = endTime - startTime
-
-        _, remainingBar, estimate = bt.timeRemaining(renderCount=renderCount, currentIter=i, iterElapsed=iterElapsed)
-        print('')
-        print(f'completion: {remainingBar}      {estimate}')
-
-        #update tracking positions
-        cameraParams['tracking']['positions'].append(cam.tracker.location)
-        cameraParams['pose'].append([cam.cam.location, cam.cam.rotation_euler])
-
-    np.warnings.filterwarnings('ignore', category=np.VisibleDeprecationWarning)
-    np.save(paths['projectionMat'] + paths['fileName'] + '.npy', setCoordinates)
-
-    #return objects home
-    for obj in objs.dynamic.keys():
-        part = bpy.data.objects[obj]
-        initLoc = objs.dynamic[obj]['initLoc']
-        bt.updateAbsPosition(part, [initLoc], 0)
-       
-
-    #return Lights Home
-    for lightName in lights.dynamic.keys():
-        light = bpy.data.objects[lightName]
-        light.data.energy = lights.dynamic[lightName]['initIntensity']
-        bt.updateAbsPosition(light, [lights.dynamic[lightName]['initLoc']], 0)
-
-    #return camera home
-    cam.cam.location = cam.initLoc
-    cam.cam.rotation_euler = cam.initRot
-
-    #data descriptions
-    description = dict()
-    description['cameraParameters'] = cameraParams
-    description['domainRandomization'] = domainRandomization
-
-    file.close()
+            timer.lap('metadata')
+
+            #append image array to full render set array
+            if projWriter:
+                writer.submit(projWriter.append, frameCoordinates)
+            elif saveVertices:
+                setCoordinates.append(frameCoordinates)    
+
+            #render, written once by blender itself (encoded to the local staging dir, the copy to paths['renders'] happens on the writer thread)
+            renderPath = paths['renders'] + str(i) + paths['fileName'] + extension
+            if dryRun:
+                if thumbnail:
+                    scene.render.filepath = thumbnailDir + str(i) + paths['fileName'] + extension
+                    bpy.ops.render.render(write_still=True)
+                timer.lap('render')
+            elif stageDir:
+                stagePath = stageDir + str(i) + paths['fileName'] + extension
+                scene.render.filepath = stagePath
+                bpy.ops.render.render(write_still=True)
+                timer.lap('render')
+                writer.submit(shutil.move, stagePath, renderPath)
+            else:
+                scene.render.filepath = renderPath
+                bpy.ops.render.render(write_still=True)
+                timer.lap('render')
+
+            if manifest: writer.submit(manifest.append, renderPath, i)
+            writer.submit(descriptions.append, metaJson)
+            writer.submit(writeRows, file, data, frameRows)
+
+            #commit last, a frame is only skipped on resume once everything it wrote is on disk
+            record = {'frame':      i,
+                      'poses':      {'camera':  [list(cam.cam.location), list(cam.cam.rotation_euler)],
+                                     'lights':  {name: [list(bpy.data.objects[name].location), bpy.data.objects[name].data.energy] for name in lights.dynamic.keys()},
+                                     'objects': {name: list(bpy.data.objects[name].location) for name in classObjs.classObjects.keys()}},
+                      'materials':  {obj.name: [slot.material.name for slot in obj.material_slots] for obj in bpy.data.objects if len(obj.material_slots) > 1},
+                      'rows':       frameRows}
+            if saveVertices and not projWriter:
+                record['coordinates'] = frameCoordinates
+            writer.submit(journal.commit, record)
+            timer.lap('save')
+
+            iterElapsed = timer.end()
+            if profiler: profiler.stop()
+
+            _, remainingBar, estimate = bt.timeRemaining(renderCount=frameCount, currentIter=i, iterElapsed=iterElapsed, average=timer.ewma['total'])
+            print('')
+            print(f'completion: {remainingBar}      {estimate}')
+            print(f'phases: {timer.status()}')
+
+            #update tracking positions
+            cameraParams['tracking']['positions'].append(cam.tracker.location)
+            cameraParams['pose'].append([cam.cam.location, cam.cam.rotation_euler])
+
+    except BaseException:
+        print(f'render loop stopped at frame {i}, writing {writer.pending()} queued output tasks and restoring the scene')
+        raise
+
+    finally:
+        #every queued frame is on disk before anything is closed, staged renders are only removed once they were moved
+        try:
+            writer.close()
+            if stageDir and not renderInfo.get('stageDir'): shutil.rmtree(stageDir, ignore_errors=True)
+        finally:
+            #the scene is restored and every file closed before the projection data is saved, a failing save
+            # never leaves the .blend with moved objects or the run's files open
+            try:
+                #return objects home
+                for obj in objs.dynamic.keys():
+                    part = bpy.data.objects[obj]
+                    initLoc = objs.dynamic[obj]['initLoc']
+                    bt.updateAbsPosition(part, [initLoc], 0)
+
+                #return Lights Home
+                for lightName in lights.dynamic.keys():
+                    light = bpy.data.objects[lightName]
+                    light.data.energy = lights.dynamic[lightName]['initIntensity']
+                    bt.updateAbsPosition(light, [lights.dynamic[lightName]['initLoc']], 0)
+
+                #return camera home
+                cam.cam.location = cam.initLoc
+                cam.cam.rotation_euler = cam.initRot
+
+                #return output path and render quality
+                scene.render.filepath = initFilePath
+                scene.render.use_file_extension = initUseExtension
+                scene.render.resolution_percentage = initPercentage
+                scene.cycles.samples = initSamples
+
+            finally:
+                timer.close()
+                if profiler: profiler.stop()
+
+                file.close()
+                if manifest: manifest.close()
+                descriptions.close()
+                journal.close()
+
+                if projWriter:
+                    projWriter.close()
+                elif saveVertices:
+                    ps.saveNpy(setCoordinates, paths['projectionMat'] + paths['fileName'] + '.npy')
 
     print("===============================================")
 
@@ -727,12 +1076,49 @@ def main(renderInfo, cameraParams, domainRandomization, paths):
  
             
 
+def parseArgs():
+
+    ''' arguments passed after '--' on the blender command line, used by renderShards.py for background runs:
+            blender -b scene.blend --python syntheticGen1.py -- --root <dataSetDir> --fileName <name> --count 100 --plan <plan.npz> --frames 0 25 --threads 8 '''
+
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog='syntheticGen1')
+    parser.add_argument('--root', default=None, help='dataset dir created by spawnDirs, overrides paths[\'root\']')
+    parser.add_argument('--fileName', default=None)
+    parser.add_argument('--count', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--resume', action='store_true', help='continue a crashed run from its journal')
+    parser.add_argument('--frames', type=int, nargs=2, default=None, help='render plan rows [start, stop) only')
+    parser.add_argument('--plan', default=None, help='scene plan .npz to load, or to write with --planOnly')
+    parser.add_argument('--planOnly', action='store_true', help='sample and save the scene plan without rendering')
+    parser.add_argument('--dryRun', action='store_true', help='write annotations for every frame without rendering')
+    parser.add_argument('--benchmarkFormats', action='store_true', help='report encode time and size of every output image format, no dataset is written')
+
+    return parser.parse_args(argv)
+
 #'/home/tuna/Documents/driving/Vision/syntheticData/dataSets/ADAS/'
 
 if __name__ == "__main__":
 
     renders = dict({
-                    'count':    10,
+                    'count':        10,
+                    'seed':         None,           # [<None>, <int>]                           seeds random/np.random/intensity sampling
+                    'threads':      None,           # [<None>, <int>]                           fixed cycles thread count, None uses blender default
+                    'resume':       False,          # [<True>, <False>]                         continue a crashed run from <root><fileName>_journal.jsonl, seed is taken from the journal
+                    'asyncWrite':   True,           # [<True>, <False>]                         write renders, csv rows, json and journal on a background thread
+                    'stageDir':     None,           # [<None>, <path>]                          fast local dir renders are encoded to before the copy, None uses a temp dir
+                    'profile':      None,           # [<None>, <{'every': int, 'frames': [int], 'memory': bool}>]   cProfile/tracemalloc dumps of sampled frames in <root>profile/
+                    'dryRun':       False,          # [<True>, <False>]                         apply the plan and write csv/description/projection output to <root>dryRun/ without rendering
+                    'thumbnail':    None,           # [<None>, <{'scale': int, 'samples': int}>] dry run only, tiny low sample render per frame in <root>dryRun/thumbnails/
+                    'frames':       None,           # [<None>, <[start, stop]>]                 render only these rows of the scene plan, frames are still numbered from 0
+                    'plan':         None,           # [<None>, <path>]                          scene plan .npz to reuse, None samples <root><fileName>_plan.npz from the seed
+                    'voxels':       None,           # [<None>, <{'resolution': int, 'cacheDir': path}>] sample closed volume constraints from an occupancy grid cached in cacheDir (default <root>voxels/)
+                    'projection':   'hull',         # [<'vertices'>, <'hull'>, <'boundBox'>]   points projected for bboxes, 'hull'/'boundBox' are cached per object
+                    'annotation':   'stream',       # [<'vertices'>, <'stream'>]                'stream' writes pixel bboxes + depth range straight into the csv
+                    'saveVertices': False,          # [<True>, <False>]                         also dump raw projected vertices to projectionMat/ (default True unless streaming)
+                    'projectionFormat': 'store',    # [<'npy'>, <'store'>, <'store16'>]         vertex dump format, 'store' is memory mappable float32, 'store16' int16 pixels + float16 depth
                     })
     
     paths = dict()
@@ -743,6 +1129,22 @@ if __name__ == "__main__":
     paths['jsonFile']=      paths['root'] + 'jsonFile/'
     paths['projectionMat']= paths['root'] + 'projectionMat/'
     paths['descriptionJson']= paths['root'] + 'descriptionJson/'
+
+    #command line overrides for headless shards
+    args = parseArgs()
+    if args.root:
+        paths['fileName'] = args.fileName or paths['fileName']
+        paths['root'] = args.root.rstrip('/') + '/'
+        for key, folder in [('renders', 'renders/'), ('csv', 'csvFile/'), ('jsonFile', 'jsonFile/'), ('projectionMat', 'projectionMat/'), ('descriptionJson', 'descriptionJson/')]:
+            paths[key] = paths['root'] + folder
+    if args.count is not None: renders['count'] = args.count
+    if args.seed is not None: renders['seed'] = args.seed
+    if args.threads is not None: renders['threads'] = args.threads
+    if args.resume: renders['resume'] = True
+    if args.frames is not None: renders['frames'] = args.frames
+    if args.plan is not None: renders['plan'] = args.plan
+    if args.planOnly: renders['planOnly'] = True
+    if args.dryRun: renders['dryRun'] = True
                   
     
                                                                                         # Parameter Options           Discription
@@ -851,16 +1253,29 @@ if __name__ == "__main__":
                         'resolution_px':        760,
                         'resolution_py':        556,
 
+                        'imageFormat':                                                  # render output, compare options with --benchmarkFormats
+                                {
+                                'format':           'PNG',                              # [<'PNG'>, <'JPEG'>, <'WEBP'>]
+                                'colorDepth':       '8',                                # [<'8'>, <'16'>]             16 bit only for PNG
+                                'compression':      15,                                 # [<int [0, 100]>]            PNG zlib effort, lossless
+                                'quality':          90                                  # [<int [0, 100]>]            JPEG/WEBP quality
+                                },
+
                         'imageIDs':             []                                      #                               list of image names
                             
     })
 
 
 
-    main(renderInfo=            renders,
-         cameraParams=          cameraParams,
-         domainRandomization=   domainRandomization,
-         paths=                 paths)
+    if args.benchmarkFormats:
+        bt.benchmarkFormats(bpy.context.scene)
+
+    else:
+        main(renderInfo=            renders,
+             cameraParams=          cameraParams,
+             domainRandomization=   domainRandomization,
+             paths=                 paths,
+             generalinfo=           generalinfo)
     
     
     
\ No newline at end of file
@@ -0,0 +1,100 @@
+import json
+import os
+import struct
+import sys
+import types
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#dataTools is a personal module that is not part of the repo, only the calls main makes are needed here
+try:
+    import dataTools
+except ImportError:
+    dataTools = types.ModuleType('dataTools')
+    dataTools.normalizeCoordinates = lambda xMin, xMax, yMin, yMax, resolutionX, resolutionY: (xMin / resolutionX, xMax / resolutionX, yMin / resolutionY, yMax / resolutionY)
+    sys.modules['dataTools'] = dataTools
+
+import buildDataSet5
+import projectionStore
+import renderManifest
+
+
+IMAGES, OBJECTS, WIDTH, HEIGHT = 5, 3, 64, 48
+
+
+def writePng(path, width, height):
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    chunk = struct.pack('>I', 13) + b'IHDR' + ihdr + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr))
+    with open(path, 'wb') as file:
+        file.write(renderManifest.PNG_SIGNATURE + chunk + renderManifest.PNG_IEND)
+
+
+@pytest.fixture
+def dataSet(tmp_path, monkeypatch):
+
+    #fixed split, the real splitData shuffles
+    monkeypatch.setattr(buildDataSet5.dataTools, 'splitData', lambda count, split: ([0, 1, 2], [3], [4]), raising=False)
+
+    root = str(tmp_path) + '/'
+    for folder in ['renders', 'csvFile', 'jsonFile', 'projectionMat']:
+        os.makedirs(root + folder)
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(IMAGES):
+        writePng(f'{root}renders/{i}set.png', WIDTH, HEIGHT)
+        frames.append([rng.uniform(0, [WIDTH, HEIGHT, 10], size=(rng.integers(3, 9), 3)) for _ in range(OBJECTS)])
+    projectionStore.saveNpy(frames, root + 'projectionMat/set.npy')
+
+    pd.DataFrame({'use':            [np.nan] * IMAGES * OBJECTS,
+                  'fileName':       [f'{i}set.png' for i in range(IMAGES) for _ in range(OBJECTS)],
+                  'classification': ['a', 'b', 'c'] * IMAGES,
+                  'xMin': 0., 'xMax': 0., 'yMin': 0., 'yMax': 0.}).to_csv(root + 'csvFile/set.csv', index=False)
+
+    return root
+
+
+def build(root, engine, gcpCsvPath):
+
+    buildDataSet5.main('set', None, root, root + 'renders/', root + 'projectionMat/set.npy', root + 'csvFile/set.csv',
+                       root + 'jsonFile/', 'gs://bucket/', [0.6, 0.2, 0.2], engine=engine, gcpCsvPath=gcpCsvPath)
+
+    with open(root + 'jsonFile/set.jsonl', 'r') as file:
+        records = [json.loads(line) for line in file]
+
+    return records, pd.read_csv(gcpCsvPath)
+
+
+def test_numpy_and_loop_engines_build_the_same_dataset(dataSet):
+
+    numpyRecords, numpyCsv = build(dataSet, 'numpy', dataSet + 'csvFile/numpy_gcp.csv')
+    loopRecords, loopCsv = build(dataSet, 'loop', dataSet + 'csvFile/loop_gcp.csv')
+
+    assert numpyRecords == loopRecords
+    pd.testing.assert_frame_equal(numpyCsv, loopCsv)
+
+
+def test_jsonl_holds_one_record_per_image(dataSet):
+
+    records, data_csv = build(dataSet, 'numpy', dataSet + 'csvFile/set_gcp.csv')
+
+    assert [record['imageGcsUri'] for record in records] == [f'gs://bucket/{i}set.png' for i in range(IMAGES)]
+    assert [record['dataItemResourceLabels']['airplatform.googleapis.com/ml_use'] for record in records] == ['train'] * 3 + ['test', 'validation']
+
+    for i, record in enumerate(records):
+        rows = data_csv.iloc[i * OBJECTS:(i + 1) * OBJECTS]
+        assert [box['displayName'] for box in record['boundingBoxAnnotations']] == ['a', 'b', 'c']
+        assert np.allclose([[box[key] for key in ['xMin', 'xMax', 'yMin', 'yMax']] for box in record['boundingBoxAnnotations']],
+                           rows[['xMin', 'xMax', 'yMin', 'yMax']].to_numpy())
+
+
+def test_render_count_must_match_the_data(dataSet):
+
+    with pytest.raises(ValueError, match='renderCount'):
+        buildDataSet5.main('set', IMAGES + 1, dataSet, dataSet + 'renders/', dataSet + 'projectionMat/set.npy', dataSet + 'csvFile/set.csv',
+                           dataSet + 'jsonFile/', 'gs://bucket/', [0.6, 0.2, 0.2])
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import descriptionStore as ds
+
+
+def test_resume_at_frame_zero_without_store_starts_fresh(tmp_path):
+
+    path = str(tmp_path / 'run')
+
+    writer = ds.descriptionWriter(path, resumeFrames=0)
+    writer.append({'frame': 0})
+    writer.close()
+
+    reader = ds.descriptionReader(path)
+    assert len(reader) == 1
+    assert reader[0] == {'frame': 0}
+
+
+def test_resume_past_frame_zero_without_store_raises(tmp_path):
+
+    with pytest.raises(FileNotFoundError, match='description store is missing'):
+        ds.descriptionWriter(str(tmp_path / 'run'), resumeFrames=2)
+
+
+def test_resume_keeps_committed_records(tmp_path):
+
+    path = str(tmp_path / 'run')
+
+    writer = ds.descriptionWriter(path)
+    for frame in range(3):
+        writer.append({'frame': frame})
+    writer.close()
+
+    writer = ds.descriptionWriter(path, resumeFrames=2)
+    writer.append({'frame': 2, 'resumed': True})
+    writer.close()
+
+    assert list(ds.descriptionReader(path)) == [{'frame': 0}, {'frame': 1}, {'frame': 2, 'resumed': True}]
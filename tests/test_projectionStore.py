@@ -0,0 +1,67 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import projectionStore as ps
+
+
+def frame(objects=2, vertices=3, value=0.):
+    return [np.full((vertices, 3), value + obj) for obj in range(objects)]
+
+
+def test_resume_at_frame_zero_without_store_starts_fresh(tmp_path):
+
+    path = str(tmp_path / 'run')
+
+    writer = ps.projectionWriter(path, objectsPerFrame=2, resumeFrames=0)
+    writer.append(frame())
+    writer.close()
+
+    reader = ps.projectionReader(path)
+    assert len(reader) == 1
+    assert np.allclose(reader[0][1], 1.)
+
+
+def test_resume_past_frame_zero_without_store_raises(tmp_path):
+
+    with pytest.raises(FileNotFoundError, match='projection store is missing'):
+        ps.projectionWriter(str(tmp_path / 'run'), objectsPerFrame=2, resumeFrames=3)
+
+
+def test_resume_keeps_committed_frames(tmp_path):
+
+    path = str(tmp_path / 'run')
+
+    writer = ps.projectionWriter(path, objectsPerFrame=2)
+    for value in range(3):
+        writer.append(frame(value=10.*value))
+    writer.close()
+
+    writer = ps.projectionWriter(path, objectsPerFrame=2, resumeFrames=2)
+    writer.append(frame(value=99.))
+    writer.close()
+
+    reader = ps.projectionReader(path)
+    assert len(reader) == 3
+    assert np.allclose(reader[1][0], 10.)
+    assert np.allclose(reader[2][0], 99.)
+
+
+def test_save_npy_ragged_frames_round_trips(tmp_path):
+
+    npyPath = str(tmp_path / 'run.npy')
+    frames = [[np.zeros((3, 3)), np.ones((5, 3))], [np.ones((4, 3)), np.zeros((3, 3))]]
+
+    ps.saveNpy(frames, npyPath)
+
+    vertMat = np.load(npyPath, allow_pickle=True)
+    assert vertMat.shape == (2, 2)
+    assert vertMat[0, 1].shape == (5, 3)
+
+    reader = ps.projectionReader(ps.convertNpy(npyPath))
+    assert len(reader) == 2
+    assert np.allclose(reader[1][0], 1.)
@@ -0,0 +1,84 @@
+import os
+import struct
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import renderManifest as rm
+
+
+def writeFile(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+    return str(path)
+
+
+def png(width, height):
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return rm.PNG_SIGNATURE + struct.pack('>I', 13) + b'IHDR' + ihdr + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr)) + b'\x00' * 32 + rm.PNG_IEND
+
+
+def jpeg(width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    dht = b'\xff\xc4' + struct.pack('>H', 4) + b'\x00\x00'          #c4 is not a frame header
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return rm.JPEG_SOI + app0 + dht + sof + b'\x00' * 32 + rm.JPEG_EOI
+
+
+def webp(chunk, payload):
+    body = b'WEBP' + chunk + struct.pack('<I', len(payload)) + payload
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def vp8(width, height):
+    return webp(b'VP8 ', b'\x00' * 3 + b'\x9d\x01\x2a' + struct.pack('<HH', width, height) + b'\x00' * 4)
+
+
+def vp8l(width, height):
+    return webp(b'VP8L', b'\x2f' + struct.pack('<I', (width - 1) | ((height - 1) << 14)) + b'\x00' * 5)
+
+
+def vp8x(width, height):
+    return webp(b'VP8X', b'\x00' * 4 + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little'))
+
+
+@pytest.mark.parametrize('name, data', [('a.png', png(760, 556)),
+                                        ('a.jpg', jpeg(760, 556)),
+                                        ('vp8.webp', vp8(760, 556)),
+                                        ('vp8l.webp', vp8l(760, 556)),
+                                        ('vp8x.webp', vp8x(760, 556))])
+def test_headers_give_resolution_and_completeness(tmp_path, name, data):
+
+    path = writeFile(tmp_path / name, data)
+
+    assert rm.readImageHeader(path) == (760, 556)
+    assert rm.isComplete(path)
+
+    truncated = writeFile(tmp_path / ('cut_' + name), data[:-3])
+    assert not rm.isComplete(truncated)
+
+
+def test_manifest_entries_flag_missing_truncated_and_resolution(tmp_path):
+
+    renderPath = str(tmp_path) + '/'
+    writeFile(tmp_path / '0a.png', png(760, 556))
+    writeFile(tmp_path / '1a.png', png(760, 556)[:-3])
+    writeFile(tmp_path / '3a.jpg', jpeg(380, 278))
+
+    entries = rm.buildManifest(renderPath, ['0a.png', '1a.png', '2a.png', '3a.jpg'])
+    problems = rm.checkManifest(entries, ['0a.png', '4a.png'])
+
+    assert problems == {'missing': [2], 'truncated': [1], 'resolution': [3], 'unlisted': ['4a.png']}
+    assert rm.resolution(entries) == (760, 556)
+
+
+def test_unknown_files_are_rejected(tmp_path):
+
+    path = writeFile(tmp_path / 'a.bmp', b'BM' + b'\x00' * 64)
+
+    with pytest.raises(ValueError):
+        rm.readImageHeader(path)
+    assert rm.manifestEntry(path, 0)['complete'] is False
@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import renderShards
+
+
+def writeJournal(path, frames, torn=False):
+    with open(path, 'w') as file:
+        file.write(json.dumps({'seed': 0, 'count': 10}) + '\n')
+        for frame in frames:
+            file.write(json.dumps({'frame': frame, 'rows': []}) + '\n')
+        if torn:
+            file.write('{"frame": ')
+
+
+def test_committed_frames_counts_contiguous_records(tmp_path):
+
+    shardDir = str(tmp_path) + '/'
+    writeJournal(shardDir + 's0_journal.jsonl', [0, 1, 2], torn=True)
+    assert renderShards.committedFrames(shardDir, 's0') == 3
+
+    writeJournal(shardDir + 's1_journal.jsonl', [0, 1, 3])
+    assert renderShards.committedFrames(shardDir, 's1') == 2
+
+    writeJournal(shardDir + 's2_journal.jsonl', [])
+    assert renderShards.committedFrames(shardDir, 's2') == 0
+    assert renderShards.committedFrames(shardDir, 'missing') == 0
+
+
+def test_commands_make_blender_fail_on_script_errors():
+
+    for command in [renderShards.planCommand('blender', 'a.blend', 's.py', 'root/', 'f', 10, 0, 'p.npz'),
+                    renderShards.shardCommand('blender', 'a.blend', 's.py', 'root/', 'f', 10, 'p.npz', 0, 5, 2)]:
+        flag = command.index('--python-exit-code')
+        assert command[flag + 1] == '1'
+        assert flag < command.index('--python') < command.index('--')